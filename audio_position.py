@@ -0,0 +1,37 @@
+"""
+Frame-accurate playback position tracking for audio sources
+"""
+import discord
+
+# Every read() from a discord.py audio source is one 20ms frame, PCM or Opus
+FRAME_SECONDS = discord.opus.Encoder.FRAME_LENGTH / 1000
+
+
+class PositionTrackingSource(discord.AudioSource):
+    """Counts the frames handed to the voice client to know where playback is.
+
+    ``start`` is the offset the underlying ffmpeg process was seeked to, so the
+    position stays correct across seeks and resumes.
+    """
+
+    def __init__(self, original: discord.AudioSource, start: float = 0.0):
+        self.original = original
+        self.start = start
+        self.frames = 0
+
+    @property
+    def position(self) -> float:
+        """Seconds into the track of the last frame read"""
+        return self.start + self.frames * FRAME_SECONDS
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        if data:
+            self.frames += 1
+        return data
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self) -> None:
+        self.original.cleanup()
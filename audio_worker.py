@@ -0,0 +1,686 @@
+"""
+Audio worker processes that run the decode/gain/encode pipeline off the gateway process
+
+The gateway process keeps the voice connections (discord.py ties them to the
+gateway session) and only sends finished Opus packets. Everything CPU-heavy
+runs in worker processes: reading ffmpeg output, applying gain, Opus encoding
+and yt-dlp extraction. Workers are commanded over a local IPC channel, a
+multiprocessing connection on a Unix socket (localhost TCP on Windows).
+InProcessAudioWorkers runs the same worker loop on threads with an in-memory
+channel, for tests.
+
+Protocol, as pickled tuples:
+    gateway -> worker: ('open', sid, spec), ('volume', sid, volume), ('credit', sid, frames),
+                       ('close', sid), ('extract', rid, url, options), ('stop',)
+    worker -> gateway: ('hello', opus_available), ('frame', sid, packet), ('end', sid, error),
+                       ('result', rid, ok, info or (error class name, message)),
+                       ('stats', ffmpeg supervisor stats)
+Frames are flow controlled with credits: a worker sends at most `window`
+frames ahead of what the voice client has played.
+
+A worker that exits is dropped from the pool and respawned in the
+background; while no worker is available, streams and lookups run in the
+gateway process as if AUDIO_WORKERS were 0.
+"""
+import itertools
+import logging
+import os
+import queue
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Client, Listener
+from typing import Any, Deque, Dict, List, Optional
+
+import discord
+
+from audio_gain import GainControl, GainTransformer
+from config import (AUDIO_WORKERS, AUDIO_WORKER_WINDOW, AUDIO_WORKER_READ_TIMEOUT, AUDIO_WORKER_START_TIMEOUT,
+                    EXTRACTOR_WORKERS,
+                    EXTRACTION_TIMEOUT, FFMPEG_SAMPLE_INTERVAL)
+from extractor import ExtractionError, _ydl_extract
+
+logger = logging.getLogger(__name__)
+
+# Frames played between credit messages back to the worker
+CREDIT_BATCH = 10
+
+
+class LocalChannel:
+    """One end of an in-memory duplex channel with the Connection send/recv API"""
+
+    def __init__(self, inbox: 'queue.Queue', outbox: 'queue.Queue'):
+        self._inbox = inbox
+        self._outbox = outbox
+
+    @classmethod
+    def pair(cls):
+        a, b = queue.Queue(), queue.Queue()
+        return cls(a, b), cls(b, a)
+
+    def send(self, message):
+        self._outbox.put(message)
+
+    def recv(self):
+        message = self._inbox.get()
+        if message is EOFError:
+            raise EOFError
+        return message
+
+    def close(self):
+        self._outbox.put(EOFError)
+
+
+# ---------- Worker side ----------
+
+class _WorkerStream:
+    def __init__(self, volume: float, window: int):
+        self.control = GainControl(volume)
+        self.credits = threading.Semaphore(window)
+        self.closed = False
+
+
+class AudioWorker:
+    """Serves pipeline and extraction commands on one channel.
+
+    With `supervise`, the worker samples its own ffmpeg processes (enforcing
+    the CPU and memory limits) and reports their stats to the gateway; an
+    in-process worker shares the gateway's already running supervisor.
+    """
+
+    def __init__(self, channel, supervise: bool = True):
+        self.channel = channel
+        self.supervise = supervise
+        self._stopped = threading.Event()
+        self._send_lock = threading.Lock()
+        self._streams: Dict[int, _WorkerStream] = {}
+        self._extract_pool = ThreadPoolExecutor(max_workers=EXTRACTOR_WORKERS, thread_name_prefix='worker-extract')
+        self.opus = discord.opus.is_loaded()
+        if not self.opus:
+            try:
+                self.opus = discord.opus._load_default()
+            except Exception:
+                self.opus = False
+
+    def send(self, message):
+        with self._send_lock:
+            self.channel.send(message)
+
+    def serve(self):
+        """Handle commands until the gateway stops the worker or disconnects"""
+        self.send(('hello', self.opus))
+        if self.supervise:
+            threading.Thread(target=self._supervise, name='worker-ffmpeg-sampler', daemon=True).start()
+        try:
+            while True:
+                try:
+                    message = self.channel.recv()
+                except (EOFError, OSError):
+                    break
+                command = message[0]
+                if command == 'stop':
+                    break
+                if command == 'open':
+                    _, sid, spec = message
+                    stream = _WorkerStream(spec.get('volume', 1.0), spec.get('window', AUDIO_WORKER_WINDOW))
+                    self._streams[sid] = stream
+                    threading.Thread(target=self._run_stream, args=(sid, spec, stream),
+                                     name=f'worker-stream-{sid}', daemon=True).start()
+                elif command == 'volume':
+                    stream = self._streams.get(message[1])
+                    if stream:
+                        stream.control.volume = message[2]
+                elif command == 'credit':
+                    stream = self._streams.get(message[1])
+                    if stream:
+                        for _ in range(message[2]):
+                            stream.credits.release()
+                elif command == 'close':
+                    stream = self._streams.pop(message[1], None)
+                    if stream:
+                        stream.closed = True
+                        stream.credits.release()
+                elif command == 'extract':
+                    self._extract_pool.submit(self._extract, *message[1:])
+        finally:
+            self._stopped.set()
+            for stream in self._streams.values():
+                stream.closed = True
+                stream.credits.release()
+            self._extract_pool.shutdown(wait=False)
+
+    def _supervise(self):
+        """Sample this process's ffmpeg children like the gateway's supervisor task does"""
+        from ffmpeg_supervisor import ffmpeg_supervisor
+        while not self._stopped.wait(FFMPEG_SAMPLE_INTERVAL):
+            try:
+                ffmpeg_supervisor.sample()
+                stats = ffmpeg_supervisor.stats()
+                self.send(('stats', {key: value for key, value in stats.items() if key != 'processes'}))
+            except (OSError, ValueError):
+                break
+            except Exception as e:
+                logger.error(f'FFmpeg sampling failed: {e}')
+
+    def _run_stream(self, sid: int, spec: Dict[str, Any], stream: _WorkerStream):
+        """Decode, scale and encode one source, pacing on the gateway's credits"""
+        # Imported here so the module stays importable where discord's FFmpeg isn't used
+        from ffmpeg_supervisor import SupervisedPCMAudio
+
+        error = None
+        source = None
+        try:
+            pcm_source = SupervisedPCMAudio(spec['input'], executable=spec['executable'],
+                                            before_options=spec.get('before_options') or None,
+                                            options=spec.get('options') or None, owner=spec.get('owner'))
+            source = GainTransformer(pcm_source, stream.control, track_gain=spec.get('track_gain', 1.0))
+            encoder = discord.opus.Encoder() if self.opus else None
+            while True:
+                stream.credits.acquire()
+                if stream.closed:
+                    return
+                data = source.read()
+                if not data:
+                    break
+                if encoder is not None:
+                    data = encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+                self.send(('frame', sid, data))
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+        finally:
+            if source is not None:
+                source.cleanup()
+        if not stream.closed:
+            self.send(('end', sid, error))
+
+    def _extract(self, rid: int, url: str, options: Dict[str, Any]):
+        try:
+            self.send(('result', rid, True, _ydl_extract(url, options)))
+        except Exception as e:
+            self.send(('result', rid, False, (e.__class__.__name__, str(e))))
+
+
+# ---------- Gateway side ----------
+
+class RemoteAudioSource(discord.AudioSource):
+    """Plays the frames a worker produces for one stream.
+
+    Volume changes on the shared GainControl are forwarded to the worker and
+    are heard once the frames it has already produced (at most `window`) have
+    played.
+    """
+
+    def __init__(self, handle: 'WorkerHandle', sid: int, control: GainControl):
+        self.handle = handle
+        self.sid = sid
+        self.control = control
+        self._sent_volume = control.volume
+        self._frames: Deque[bytes] = deque()
+        self._ready = threading.Condition()
+        self._ended = False
+        self.error: Optional[str] = None
+        self._consumed = 0
+        self._closed = False
+
+    def _push(self, frame: bytes):
+        with self._ready:
+            self._frames.append(frame)
+            self._ready.notify()
+
+    def _end(self, error: Optional[str]):
+        with self._ready:
+            self._ended = True
+            self.error = error
+            self._ready.notify()
+        if error:
+            logger.warning(f'Audio worker stream {self.sid} failed: {error}')
+
+    def read(self) -> bytes:
+        if self.control.volume != self._sent_volume:
+            self._sent_volume = self.control.volume
+            self.handle.send(('volume', self.sid, self._sent_volume))
+
+        with self._ready:
+            if not self._ready.wait_for(lambda: self._frames or self._ended, AUDIO_WORKER_READ_TIMEOUT):
+                # A stalled worker ends the track like a stalled ffmpeg pipe would
+                logger.warning(f'Audio worker stream {self.sid} stalled')
+                return b''
+            if not self._frames:
+                return b''
+            frame = self._frames.popleft()
+
+        self._consumed += 1
+        if self._consumed % CREDIT_BATCH == 0:
+            self.handle.send(('credit', self.sid, CREDIT_BATCH))
+        return frame
+
+    def is_opus(self) -> bool:
+        return self.handle.opus
+
+    def cleanup(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.handle.close_stream(self.sid)
+
+
+def _remote_error(name: str, message: str) -> ExtractionError:
+    """Rebuild an error raised by a lookup in a worker"""
+    if name == 'ExtractionError':
+        return ExtractionError(message)
+    return ExtractionError(f'{name}: {message}')
+
+
+class WorkerHandle:
+    """Gateway-side end of one worker's channel"""
+
+    def __init__(self, channel, opus: bool, process=None):
+        self.channel = channel
+        self.opus = opus
+        self.process = process
+        self.alive = True
+        self.stopping = False
+        # Latest stats of the worker's own ffmpeg supervisor
+        self.ffmpeg_stats: Dict[str, Any] = {}
+        self._send_lock = threading.Lock()
+        self._streams: Dict[int, RemoteAudioSource] = {}
+        # Written by caller threads, resolved by the reader thread
+        self._requests: Dict[int, Future] = {}
+        self._requests_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_loop, name='audio-worker-reader', daemon=True)
+        self._reader.start()
+
+    @property
+    def load(self) -> int:
+        return len(self._streams)
+
+    @property
+    def pending(self) -> int:
+        with self._requests_lock:
+            return len(self._requests)
+
+    def send(self, message):
+        with self._send_lock:
+            self.channel.send(message)
+
+    def _read_loop(self):
+        while True:
+            try:
+                message = self.channel.recv()
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == 'frame':
+                stream = self._streams.get(message[1])
+                if stream:
+                    stream._push(message[2])
+            elif kind == 'end':
+                stream = self._streams.get(message[1])
+                if stream:
+                    stream._end(message[2])
+            elif kind == 'result':
+                with self._requests_lock:
+                    future = self._requests.pop(message[1], None)
+                if future:
+                    if message[2]:
+                        future.set_result(message[3])
+                    else:
+                        future.set_exception(_remote_error(*message[3]))
+            elif kind == 'stats':
+                self.ffmpeg_stats = message[1]
+
+        # Worker gone: end its streams and fail pending requests
+        with self._requests_lock:
+            self.alive = False
+            requests = list(self._requests.values())
+            self._requests.clear()
+        self.ffmpeg_stats = {}
+        for stream in list(self._streams.values()):
+            stream._end('audio worker exited')
+        for future in requests:
+            future.set_exception(ExtractionError('audio worker exited'))
+        if self.process is not None and not self.stopping:
+            logger.error(f'Audio worker (pid {self.process.pid}) exited')
+
+    def open_stream(self, sid: int, spec: Dict[str, Any], control: GainControl) -> RemoteAudioSource:
+        source = RemoteAudioSource(self, sid, control)
+        self._streams[sid] = source
+        try:
+            self.send(('open', sid, dict(spec, volume=control.volume)))
+        except (OSError, ValueError):
+            self._streams.pop(sid, None)
+            raise
+        return source
+
+    def close_stream(self, sid: int):
+        if self._streams.pop(sid, None) is not None:
+            try:
+                self.send(('close', sid))
+            except (OSError, ValueError):
+                pass
+
+    def request(self, rid: int, *args) -> Future:
+        future: Future = Future()
+        with self._requests_lock:
+            if not self.alive:
+                raise OSError('audio worker exited')
+            self._requests[rid] = future
+        try:
+            self.send(('extract', rid, *args))
+        except (OSError, ValueError):
+            with self._requests_lock:
+                self._requests.pop(rid, None)
+            raise
+        return future
+
+    def cancel(self, rid: int):
+        """Stop waiting for a request; a late result is ignored"""
+        with self._requests_lock:
+            self._requests.pop(rid, None)
+
+    def stop(self):
+        self.stopping = True
+        try:
+            self.send(('stop',))
+        except (OSError, ValueError):
+            pass
+
+
+class AudioWorkers:
+    """Pool of audio worker processes; streams go to the least loaded worker"""
+
+    def __init__(self, workers: int, extract_timeout: float = EXTRACTION_TIMEOUT):
+        self.workers = workers
+        self.extract_timeout = extract_timeout
+        self._handles: List[WorkerHandle] = []
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._ids = itertools.count(1)
+
+    def _spawn_worker(self, index: int) -> WorkerHandle:
+        """Start a worker process and wait for its hello; raises OSError if it doesn't come up"""
+        authkey = secrets.token_bytes(16)
+        directory = None
+        if sys.platform == 'win32':
+            listener = Listener(('127.0.0.1', 0), authkey=authkey)
+        else:
+            directory = tempfile.mkdtemp(prefix='audio-worker-')
+            listener = Listener(os.path.join(directory, 'ipc.sock'), family='AF_UNIX', authkey=authkey)
+        process = None
+        channel = None
+        try:
+            env = dict(os.environ, AUDIO_WORKER_AUTHKEY=authkey.hex())
+            address = listener.address if isinstance(listener.address, str) else f'{listener.address[0]}:{listener.address[1]}'
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), address], env=env)
+            channel = _accept(listener, process, AUDIO_WORKER_START_TIMEOUT)
+            if not channel.poll(AUDIO_WORKER_START_TIMEOUT):
+                raise OSError(f'audio worker did not report ready within {AUDIO_WORKER_START_TIMEOUT}s')
+            try:
+                hello = channel.recv()
+            except EOFError:
+                raise OSError('audio worker exited during startup') from None
+        except BaseException:
+            # A worker that died on startup (import error, ...) must not hang the bot
+            if channel is not None:
+                channel.close()
+            if process is not None:
+                if process.poll() is None:
+                    process.kill()
+                process.wait()
+            raise
+        finally:
+            listener.close()
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+        logger.info(f'Audio worker {index} started (pid {process.pid}, opus={"yes" if hello[1] else "no"})')
+        return WorkerHandle(channel, hello[1], process)
+
+    def start(self):
+        """Start the workers; blocking, so run it in an executor.
+
+        A worker that fails to start is logged and left out; with none,
+        playback runs in the gateway process.
+        """
+        self._stopping = False
+        for index in range(self.workers):
+            try:
+                handle = self._spawn_worker(index)
+            except OSError as e:
+                logger.error(f'Audio worker {index} failed to start: {e}')
+                continue
+            with self._lock:
+                self._handles.append(handle)
+
+    def _alive_handles(self) -> List[WorkerHandle]:
+        """Get the live workers, replacing any that exited"""
+        with self._lock:
+            dead = [handle for handle in self._handles if not handle.alive]
+            if dead:
+                self._handles = [handle for handle in self._handles if handle.alive]
+            handles = list(self._handles)
+        for handle in dead:
+            if handle.process is not None:
+                handle.process.poll()
+            if not self._stopping:
+                threading.Thread(target=self._respawn, name='audio-worker-respawn', daemon=True).start()
+        return handles
+
+    def _respawn(self):
+        try:
+            handle = self._spawn_worker(len(self._handles))
+        except Exception as e:
+            logger.error(f'Could not restart audio worker: {e}')
+            return
+        with self._lock:
+            if self._stopping:
+                handle.stop()
+            else:
+                self._handles.append(handle)
+
+    def open_stream(self, spec: Dict[str, Any], control: GainControl) -> Optional[RemoteAudioSource]:
+        """Start a pipeline on the least loaded worker and get a source playing it.
+
+        Returns None if no worker is running, so the caller plays in-process.
+        """
+        handles = self._alive_handles()
+        while handles:
+            handle = min(handles, key=lambda h: h.load)
+            try:
+                return handle.open_stream(next(self._ids), spec, control)
+            except (OSError, ValueError):
+                handles.remove(handle)
+        logger.warning('No audio worker available; playing in the gateway process')
+        return None
+
+    def extract(self, url: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a yt-dlp extraction in a worker; blocking, as AsyncExtractor expects.
+
+        Worker failures raise ExtractionError. Without a running worker the
+        lookup runs on the calling thread.
+        """
+        handles = self._alive_handles()
+        while handles:
+            handle = min(handles, key=lambda h: h.pending)
+            rid = next(self._ids)
+            try:
+                future = handle.request(rid, url, options)
+            except (OSError, ValueError):
+                handles.remove(handle)
+                continue
+            try:
+                return future.result(timeout=self.extract_timeout)
+            except FutureTimeoutError:
+                handle.cancel(rid)
+                raise ExtractionError(f'Audio worker lookup timed out after {self.extract_timeout} seconds') from None
+        return _ydl_extract(url, options)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Get active streams and pending extractions per worker"""
+        with self._lock:
+            handles = list(self._handles)
+        return [{'pid': getattr(h.process, 'pid', None), 'streams': h.load, 'extractions': h.pending,
+                 'alive': h.alive} for h in handles]
+
+    def ffmpeg_stats(self) -> Dict[str, float]:
+        """Get the ffmpeg totals (running, spawned, cpu_percent...) of every live worker"""
+        with self._lock:
+            handles = list(self._handles)
+        totals: Dict[str, float] = {}
+        for handle in handles:
+            if handle.alive:
+                for key, value in handle.ffmpeg_stats.items():
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def stop(self):
+        """Stop every worker"""
+        with self._lock:
+            self._stopping = True
+            handles = list(self._handles)
+        for handle in handles:
+            handle.stop()
+        for handle in handles:
+            if handle.process is not None:
+                try:
+                    handle.process.wait(timeout=5)
+                except Exception:
+                    handle.process.kill()
+        with self._lock:
+            self._handles.clear()
+
+
+class InProcessAudioWorkers(AudioWorkers):
+    """Runs the worker loop on threads over in-memory channels, for tests"""
+
+    def _spawn_worker(self, index: int) -> WorkerHandle:
+        gateway_end, worker_end = LocalChannel.pair()
+        # Shares this process's ffmpeg supervisor, which the bot already samples
+        worker = AudioWorker(worker_end, supervise=False)
+        threading.Thread(target=worker.serve, name=f'audio-worker-{index}', daemon=True).start()
+        hello = gateway_end.recv()
+        return WorkerHandle(gateway_end, hello[1])
+
+
+def _accept(listener: Listener, process: subprocess.Popen, timeout: float):
+    """Accept the worker's connection, giving up if it exits or takes longer than timeout"""
+    accepted: Dict[str, Any] = {}
+
+    def accept():
+        try:
+            accepted['channel'] = listener.accept()
+        except Exception as e:
+            accepted['error'] = e
+
+    thread = threading.Thread(target=accept, name='audio-worker-accept', daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while thread.is_alive() and process.poll() is None and time.monotonic() < deadline:
+        thread.join(0.1)
+    if thread.is_alive():
+        # Wake the blocked accept() with a connection that fails the handshake
+        family = socket.AF_UNIX if isinstance(listener.address, str) else socket.AF_INET
+        try:
+            with socket.socket(family) as sock:
+                sock.connect(listener.address)
+        except OSError:
+            pass
+        thread.join(1)
+        if 'channel' in accepted:
+            accepted.pop('channel').close()
+        reason = 'exited' if process.poll() is not None else f'did not connect within {timeout}s'
+        raise OSError(f'audio worker {reason}')
+    if 'error' in accepted:
+        raise OSError(f'audio worker could not connect: {accepted["error"]}')
+    return accepted['channel']
+
+
+# Shared by every guild's MusicPlayer; None keeps the pipeline in-process
+audio_workers: Optional[AudioWorkers] = AudioWorkers(AUDIO_WORKERS) if AUDIO_WORKERS > 0 else None
+
+
+def _worker_main(address: str):
+    authkey = bytes.fromhex(os.environ['AUDIO_WORKER_AUTHKEY'])
+    if ':' in address and not os.path.exists(address):
+        host, port = address.rsplit(':', 1)
+        channel = Client((host, int(port)), authkey=authkey)
+    else:
+        channel = Client(address, family='AF_UNIX', authkey=authkey)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - audio-worker - %(levelname)s - %(message)s')
+    AudioWorker(channel).serve()
+
+
+def _benchmark(streams: int, seconds: float, ffmpeg: str, workers: int):
+    """Event-loop lag in the gateway process while streams play in-process vs in workers"""
+    import asyncio
+    from ffmpeg_supervisor import FFmpegSupervisor, SupervisedPCMAudio
+
+    spec = {'executable': ffmpeg, 'input': 'sine=frequency=440:sample_rate=48000',
+            'before_options': '-f lavfi', 'options': '-vn'}
+    supervisor = FFmpegSupervisor(max_processes=streams + 1, max_per_owner=streams + 1)
+    encoder_available = discord.opus.is_loaded() or discord.opus._load_default()
+
+    def play(make_source, stop: threading.Event):
+        # Paced like discord.py's AudioPlayer: one frame per 20ms
+        source = make_source()
+        encoder = discord.opus.Encoder() if encoder_available and not source.is_opus() else None
+        next_frame = time.perf_counter()
+        while not stop.is_set():
+            data = source.read()
+            if not data:
+                break
+            if encoder is not None:
+                encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+            next_frame += 0.02
+            time.sleep(max(0.0, next_frame - time.perf_counter()))
+        source.cleanup()
+
+    async def measure(label: str, make_source):
+        stop = threading.Event()
+        threads = [threading.Thread(target=play, args=(make_source, stop), daemon=True) for _ in range(streams)]
+        for thread in threads:
+            thread.start()
+        lags = []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        while loop.time() < deadline:
+            started = loop.time()
+            await asyncio.sleep(0.01)
+            lags.append(loop.time() - started - 0.01)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        lags.sort()
+        print(f'{label:>12}: loop lag p50 {lags[len(lags) // 2] * 1000:.2f}ms, '
+              f'p99 {lags[int(len(lags) * 0.99)] * 1000:.2f}ms, max {lags[-1] * 1000:.2f}ms')
+
+    async def run():
+        control = GainControl(0.5)
+        await measure('in-process', lambda: GainTransformer(
+            SupervisedPCMAudio(spec['input'], executable=ffmpeg, before_options=spec['before_options'],
+                               options=spec['options'], supervisor=supervisor), control))
+        pool = AudioWorkers(workers)
+        pool.start()
+        try:
+            await measure(f'{workers} workers', lambda: pool.open_stream(spec, control))
+        finally:
+            pool.stop()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == '--benchmark':
+        # python audio_worker.py --benchmark [streams] [seconds] [workers]
+        from ffmpeg_locator import find_ffmpeg
+        _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 16,
+                   float(sys.argv[3]) if len(sys.argv) > 3 else 10,
+                   os.getenv('FFMPEG_PATH') or find_ffmpeg(),
+                   int(sys.argv[4]) if len(sys.argv) > 4 else (os.cpu_count() or 2))
+    else:
+        _worker_main(sys.argv[1])
@@ -0,0 +1,92 @@
+"""
+Application command sync that only uploads when the command schema changes
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from discord import app_commands
+
+from config import COMMAND_SYNC_PATH, FORCE_COMMAND_SYNC
+
+logger = logging.getLogger(__name__)
+
+
+def command_schema(tree: app_commands.CommandTree) -> List[Dict[str, Any]]:
+    """Get the global command payloads sync() would upload, in a stable order"""
+    commands = [command.to_dict(tree) for command in tree.get_commands()]
+    return sorted(commands, key=lambda command: (command.get('type', 1), command['name']))
+
+
+def schema_hash(tree: app_commands.CommandTree) -> str:
+    """Get a hash of the command schema that only changes when the commands do"""
+    payload = json.dumps(command_schema(tree), sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _load_hashes(path: str) -> Dict[str, str]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return hashes if isinstance(hashes, dict) else {}
+
+
+def _save_hashes(path: str, hashes: Dict[str, str]):
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(hashes, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning(f'Could not persist command schema hash: {e}')
+
+
+class CommandSync:
+    """Syncs global commands once per schema change.
+
+    The last synced hash is stored per application id, so a restart or a
+    gateway reconnect with unchanged commands skips the upload (and its rate
+    limit) entirely. A different bot token, or any change to a command's
+    name, options, description or permissions, changes the hash.
+    """
+
+    def __init__(self, path: str = COMMAND_SYNC_PATH, force: bool = FORCE_COMMAND_SYNC):
+        self.path = path
+        self.force = force
+        # Application id -> hash synced by this process
+        self._synced: Dict[str, str] = {}
+
+    async def sync(self, tree: app_commands.CommandTree, application_id: int,
+                   force: bool = False) -> Optional[List[app_commands.AppCommand]]:
+        """Upload the commands if they changed; returns the synced commands, or None if skipped"""
+        current = schema_hash(tree)
+        key = str(application_id)
+        force = force or self.force
+        if not force:
+            # Reconnects in the same process don't even need the file
+            if self._synced.get(key) == current:
+                logger.debug('Command schema unchanged since last sync in this process')
+                return None
+            if _load_hashes(self.path).get(key) == current:
+                self._synced[key] = current
+                logger.info(f'Command schema unchanged ({current[:12]}); skipping sync')
+                return None
+
+        synced = await tree.sync()
+        self._synced[key] = current
+        # The environment force only applies to the first sync of a run
+        self.force = False
+        hashes = _load_hashes(self.path)
+        hashes[key] = current
+        _save_hashes(self.path, hashes)
+        logger.info(f'Synced {len(synced)} application commands (schema {current[:12]})')
+        return synced
+
+
+# Shared by the whole bot
+command_sync = CommandSync()
@@ -6,9 +6,20 @@ BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN', 'your_bot_token_here')
 # FFmpeg options for audio playback
 FFMPEG_OPTIONS = {
     'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -nostdin',
-    'options': '-vn -filter:a "volume=0.5"'
+    'options': '-vn'
 }
 
+# Playback volume (1.0 = unchanged); applied in-process per 20ms frame
+DEFAULT_VOLUME = 0.5
+MAX_VOLUME = 2.0
+
+# Loudness Normalization (measured once per track in the background)
+LOUDNESS_NORMALIZATION = True
+LOUDNESS_TARGET_LUFS = -14.0
+LOUDNESS_MAX_GAIN_DB = 12.0  # cap on boost/cut per track
+LOUDNESS_WORKERS = 1  # concurrent analyses (one low-priority ffmpeg each)
+LOUDNESS_TIMEOUT = 300  # seconds per analysis
+
 # YouTube-DL options with cookie support
 YDL_OPTIONS = {
     'format': 'bestaudio[ext=m4a]/bestaudio/best',
@@ -40,13 +51,119 @@ YDL_OPTIONS = {
 }
 
 # Bot Settings
-MAX_QUEUE_SIZE = 50
+MAX_QUEUE_SIZE = 1000
+QUEUE_PAGE_SIZE = 10  # songs per /queue page
 MAX_SONG_DURATION = 3600  # 1 hour in seconds
 COMMAND_TIMEOUT = 30  # seconds
 
+# Extraction Settings
+EXTRACTOR_WORKERS = 4  # concurrent yt-dlp lookups across all guilds
+EXTRACTION_TIMEOUT = 30  # seconds per lookup
+PLAYLIST_BATCH_SIZE = 100  # playlist entries queued per progress update
+
+# State Settings (exclusions, per-guild settings and queue snapshots)
+# Point BOT_DATA_DIR at a persistent volume so state survives redeploys
+DATA_DIR = os.getenv('BOT_DATA_DIR', 'data')
+STATE_DB_PATH = os.path.join(DATA_DIR, 'state.sqlite3')
+STATE_FLUSH_INTERVAL = 2.0  # seconds changes wait so they are written in batches
+STATE_POSITION_INTERVAL = 15.0  # seconds between saves of the playing song's position
+
+# Cache Settings
+# Point BOT_CACHE_DIR at a persistent volume so caches survive redeploys
+CACHE_DIR = os.getenv('BOT_CACHE_DIR', 'cache')
+METADATA_DB_PATH = os.path.join(CACHE_DIR, 'metadata.sqlite3')
+FFMPEG_CACHE_PATH = os.path.join(CACHE_DIR, 'ffmpeg.json')
+LIBRARY_INDEX_PATH = os.path.join(CACHE_DIR, 'library_index.json')
+OPUS_CACHE_DIR = os.path.join(CACHE_DIR, 'opus')
+COMMAND_SYNC_PATH = os.path.join(CACHE_DIR, 'command_sync.json')
+
+# Command Sync Settings
+# Commands are only uploaded when their schema hash changes; set
+# FORCE_COMMAND_SYNC=1 (or use /synccommands as the bot owner) to upload anyway
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '0') == '1'
+
+# Opus Cache Settings
+OPUS_CACHE_MAX_BYTES = 2 * 1024 ** 3  # 2 GiB of pre-encoded tracks
+OPUS_CACHE_HOT_PLAYS = 2  # YouTube plays before a track is encoded (local tracks: 1)
+OPUS_CACHE_BITRATE = '128k'
+OPUS_ENCODE_CONCURRENCY = 1  # background encodes at a time
+
+# Music Library Settings
+LIBRARY_POLL_INTERVAL = 60  # seconds between rescans when watchdog isn't installed
+LIBRARY_WATCH_DEBOUNCE = 2  # seconds to wait for file changes to settle
+
+# Stream Cache Settings
+STREAM_CACHE_SIZE = 512  # resolved stream URLs kept in memory
+STREAM_CACHE_TTL = 3600  # seconds, for URLs without an expire= parameter
+STREAM_EXPIRY_MARGIN = 60  # seconds of validity kept in reserve
+STREAM_FAILURE_WINDOW = 3  # a cached stream ending sooner than this is treated as a failed open
+
+# FFmpeg Process Limits (playback processes)
+FFMPEG_MAX_PROCESSES = 64
+FFMPEG_MAX_PER_GUILD = 3  # current song, a warmed-up next song and a seek in progress
+FFMPEG_NICE = 5  # below the bot itself, above background Opus encodes (10)
+FFMPEG_CGROUP = os.getenv('FFMPEG_CGROUP')  # optional cgroup v2 directory, e.g. with a cpu.max limit
+FFMPEG_SAMPLE_INTERVAL = 5  # seconds between CPU/RSS samples
+FFMPEG_CPU_LIMIT = 50  # percent of a core before a process is throttled
+FFMPEG_MAX_RSS = 256 * 1024 * 1024  # bytes before a process is killed
+
+# Audio Worker Settings
+# Processes that decode, scale and Opus-encode audio (and run yt-dlp) so the
+# gateway process only sends packets; 0 keeps the pipeline in-process
+AUDIO_WORKERS = int(os.getenv('AUDIO_WORKERS', '0'))
+AUDIO_WORKER_WINDOW = 50  # frames (20ms each) a worker may run ahead of playback
+AUDIO_WORKER_READ_TIMEOUT = 5  # seconds without a frame before a stream counts as stalled
+AUDIO_WORKER_START_TIMEOUT = 30  # seconds a new worker has to connect back and say hello
+
+# HTTP Client Settings (one pooled session for all outbound HTTP)
+HTTP_POOL_SIZE = 100  # open connections across all hosts
+HTTP_POOL_PER_HOST = 10
+HTTP_KEEPALIVE = 30  # seconds an idle connection stays open for reuse
+HTTP_TIMEOUT = 10  # seconds per attempt
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_RETRIES = 2  # extra attempts after connection errors, timeouts, 429 and 5xx
+HTTP_RETRY_BACKOFF = 0.5  # seconds before the first retry, doubled each time
+
+# Weather Settings
+WEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY')
+WEATHER_API_URL = 'http://api.openweathermap.org/data/2.5/weather'
+WEATHER_CACHE_TTL = 600  # seconds a city's weather is served without asking the API
+WEATHER_STALE_TTL = 1800  # further seconds it is served while a refresh runs in the background
+WEATHER_NOT_FOUND_TTL = 300  # seconds an unknown city is remembered
+WEATHER_CACHE_SIZE = 1024  # cities kept in memory
+
+# Seek/Resume Settings
+RESUME_MAX_ATTEMPTS = 3  # times one song is resumed after its stream dies
+RESUME_END_MARGIN = 5  # seconds; songs ending closer to their end count as finished
+RESUME_RECONNECT_TIMEOUT = 120  # seconds to hold a song for a dropped voice connection
+
+# Prefetch Settings
+PREFETCH_WARM_FFMPEG = False  # also spawn the next song's ffmpeg before handover
+PREFETCH_WARM_LEAD = 10  # seconds before the current song ends to spawn it
+
+# Sharding Settings
+# Leave both unset to run every shard in one process with Discord's recommended
+# count; `python sharding.py` sets them for each process it launches
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) or None
+SHARD_IDS = os.getenv('SHARD_IDS')  # shards of this process, e.g. "0-3"
+
+# Keep-Alive / Metrics Server
+# Serves "/", "/healthz", "/readyz" and "/metrics" (see health_server.py).
+# Shard processes started by sharding.py listen on KEEP_ALIVE_PORT + their index
+KEEP_ALIVE_ENABLED = os.getenv('KEEP_ALIVE', '1') != '0'
+KEEP_ALIVE_PORT = int(os.getenv('PORT', '8080')) + int(os.getenv('SHARD_PROCESS_INDEX', '0'))
+
 # Logging Configuration
-LOG_LEVEL = 'INFO'
+# Records are queued on the calling thread and written by a background thread
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 LOG_FILE = 'discord_bot.log'
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # 'text', or 'json' for one JSON object per line
+LOG_MAX_BYTES = 10 * 1024 * 1024  # rotate the file at this size...
+LOG_ROTATE_INTERVAL = 24 * 3600  # ...or after this many seconds, whichever comes first
+LOG_BACKUP_COUNT = 5  # rotated files kept
+LOG_QUEUE_SIZE = 10000  # records waiting for the writer; further records are dropped and counted
+# Keep 1 in N records below WARNING from each call site of a logger, e.g. {'music_player': 10}
+LOG_SAMPLE_EVERY = {}
 
 # Voice Settings
 VOICE_TIMEOUT = 300  # 5 minutes of inactivity before auto-disconnect
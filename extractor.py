@@ -0,0 +1,255 @@
+"""
+Asynchronous yt-dlp extraction service
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import YDL_OPTIONS, EXTRACTOR_WORKERS, EXTRACTION_TIMEOUT, PLAYLIST_BATCH_SIZE
+from metrics import EXTRACTION_TIME
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionTimeout(Exception):
+    """Raised when a yt-dlp lookup does not finish within its timeout"""
+
+
+class ExtractionError(Exception):
+    """Raised when yt-dlp cannot look up a URL; the message is yt-dlp's own"""
+
+
+def _yt_dlp():
+    """Import yt-dlp on first use; it is one of the slowest imports at startup"""
+    import yt_dlp
+    return yt_dlp
+
+
+def _as_extraction_error(error: Exception) -> Exception:
+    if isinstance(error, _yt_dlp().utils.DownloadError):
+        return ExtractionError(str(error))
+    return error
+
+
+def _ydl_extract(url: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Blocking yt-dlp lookup, run on a worker thread"""
+    yt_dlp = _yt_dlp()
+    try:
+        with yt_dlp.YoutubeDL(options) as ydl:
+            return ydl.extract_info(url, download=False)
+    except yt_dlp.utils.DownloadError as e:
+        raise ExtractionError(str(e)) from None
+
+
+# Flat extraction lists playlist entries without resolving each video
+PLAYLIST_OPTIONS = dict(YDL_OPTIONS, noplaylist=False, extract_flat='in_playlist', lazy_playlist=True)
+
+_END = object()
+
+# Redirects followed before giving up, e.g. watch?v=X&list=Y -> playlist -> tab
+MAX_URL_REDIRECTS = 5
+
+
+def _resolve_url_results(ydl, url: str) -> Dict[str, Any]:
+    """Unprocessed lookup that follows 'url' results to the page they point at"""
+    info = ydl.extract_info(url, download=False, process=False)
+    for _ in range(MAX_URL_REDIRECTS):
+        if info.get('_type') not in ('url', 'url_transparent'):
+            break
+        info = ydl.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+    return info
+
+
+def _entries_then_close(ydl, entries: Iterable[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+    # Pages are fetched with the YoutubeDL instance, so it stays open until iteration ends
+    with ydl:
+        yield from entries
+
+
+def _ydl_playlist(url: str, options: Dict[str, Any]) -> Tuple[str, Iterable[Dict[str, Any]]]:
+    """Blocking flat playlist lookup; entries are fetched page by page as they are iterated"""
+    ydl = _yt_dlp().YoutubeDL(options)
+    try:
+        info = _resolve_url_results(ydl, url)
+    except BaseException:
+        ydl.close()
+        raise
+    entries = info.get('entries')
+    if entries is None:
+        # A single video rather than a playlist
+        ydl.close()
+        return info.get('title', 'Unknown'), [info]
+    if hasattr(entries, 'getslice'):
+        # Paged playlists only load pages when sliced
+        entries = entries.getslice()
+    return info.get('title', 'Unknown Playlist'), _entries_then_close(ydl, entries)
+
+
+class AsyncExtractor:
+    """Runs yt-dlp lookups on a bounded worker pool so the event loop never blocks"""
+
+    def __init__(self, max_workers: int = EXTRACTOR_WORKERS, timeout: float = EXTRACTION_TIMEOUT,
+                 extract_func: Optional[Callable[[str, Dict[str, Any]], Dict[str, Any]]] = None,
+                 playlist_func: Optional[Callable[[str, Dict[str, Any]], Tuple[str, Iterable[Dict[str, Any]]]]] = None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._extract_func = extract_func or _ydl_extract
+        self._playlist_func = playlist_func or _ydl_playlist
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='yt-dlp')
+        # A slot is only released once its worker thread has actually returned,
+        # so timed-out lookups still count against the pool size.
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def set_extract_func(self, extract_func: Callable[[str, Dict[str, Any]], Dict[str, Any]]):
+        """Route single-video lookups elsewhere, e.g. to audio worker processes"""
+        self._extract_func = extract_func
+
+    async def preload(self):
+        """Import yt-dlp on a pool thread, so the first lookup doesn't pay for it"""
+        await asyncio.get_running_loop().run_in_executor(self._executor, _yt_dlp)
+
+    async def _submit(self, func: Callable, *args: Any) -> Future:
+        """Run a blocking call on the pool once a slot is free"""
+        loop = asyncio.get_running_loop()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        await self._slots.acquire()
+        try:
+            job = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(self._slots.release))
+        return job
+
+    async def extract(self, url: str, options: Optional[Dict[str, Any]] = None,
+                      timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Extract info for a URL or search term without blocking the event loop.
+
+        Raises ExtractionTimeout if the lookup takes longer than the timeout, and
+        ExtractionError if yt-dlp cannot look the URL up. Cancelling the caller cancels the
+        lookup if it has not started yet.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        outcome = 'error'
+
+        job = await self._submit(self._extract_func, url, options or YDL_OPTIONS)
+        try:
+            info = await asyncio.wait_for(asyncio.wrap_future(job), timeout)
+            outcome = 'ok'
+            return info
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            logger.warning(f'Extraction timed out after {timeout}s: {url}')
+            raise ExtractionTimeout(f'Lookup timed out after {timeout} seconds')
+        finally:
+            elapsed = time.perf_counter() - started
+            EXTRACTION_TIME.observe(elapsed, outcome)
+            logger.debug(f'Extraction of {url} took {elapsed:.2f}s')
+
+    async def iter_playlist(self, url: str, batch_size: int = PLAYLIST_BATCH_SIZE,
+                            timeout: Optional[float] = None) -> AsyncIterator[Tuple[str, List[Dict[str, Any]]]]:
+        """Stream flat playlist entries in batches as (playlist title, entries).
+
+        Entries only carry what the playlist page lists (id, title, duration...);
+        resolve each one with extract() when it is about to play. The timeout
+        applies to the wait for each batch. Closing the iterator early stops the
+        worker thread after its current page.
+        """
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        batches: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def produce():
+            entries = None
+            try:
+                title, entries = self._playlist_func(url, PLAYLIST_OPTIONS)
+                batch = []
+                for entry in entries:
+                    if stop.is_set():
+                        return
+                    if entry:
+                        batch.append(entry)
+                    if len(batch) >= batch_size:
+                        loop.call_soon_threadsafe(batches.put_nowait, (title, batch))
+                        batch = []
+                if batch:
+                    loop.call_soon_threadsafe(batches.put_nowait, (title, batch))
+                loop.call_soon_threadsafe(batches.put_nowait, _END)
+            except Exception as e:
+                loop.call_soon_threadsafe(batches.put_nowait, _as_extraction_error(e))
+            finally:
+                # Releases the lookup's resources when stopped early
+                close = getattr(entries, 'close', None)
+                if close is not None:
+                    close()
+
+        await self._submit(produce)
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(batches.get(), timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f'Playlist extraction stalled for {timeout}s: {url}')
+                    raise ExtractionTimeout(f'Playlist lookup timed out after {timeout} seconds')
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def shutdown(self):
+        """Stop accepting work and release the worker threads"""
+        self._executor.shutdown(wait=False)
+
+
+# Shared by every guild's MusicPlayer
+extractor = AsyncExtractor()
+
+
+if __name__ == "__main__":
+    # Benchmark: event-loop lag while N concurrent extractions run against a stub
+    import sys
+
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    lag_threshold = 0.05  # seconds
+
+    def stub_extract(url, options):
+        time.sleep(0.5)  # simulate a slow YouTube lookup
+        return {'id': url, 'title': url, 'url': f'https://example.invalid/{url}'}
+
+    async def benchmark():
+        service = AsyncExtractor(max_workers=8, timeout=30, extract_func=stub_extract)
+        max_lag = 0.0
+        done = asyncio.Event()
+
+        async def measure_lag():
+            nonlocal max_lag
+            interval = 0.01
+            while not done.is_set():
+                before = time.perf_counter()
+                await asyncio.sleep(interval)
+                max_lag = max(max_lag, time.perf_counter() - before - interval)
+
+        monitor = asyncio.create_task(measure_lag())
+        started = time.perf_counter()
+        await asyncio.gather(*(service.extract(f'video-{i}') for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await monitor
+        service.shutdown()
+
+        print(f'{concurrency} extractions in {elapsed:.2f}s, max loop lag {max_lag * 1000:.1f}ms')
+        if max_lag > lag_threshold:
+            print(f'FAIL: loop lag exceeded {lag_threshold * 1000:.0f}ms')
+            sys.exit(1)
+        print('OK')
+
+    asyncio.run(benchmark())
@@ -0,0 +1,150 @@
+"""
+FFmpeg discovery and capability probing, done once and cached
+"""
+import glob
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+from typing import Any, Dict, Optional
+
+from config import FFMPEG_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_ffmpeg_info: Optional[Dict[str, Any]] = None
+
+
+def _search_ffmpeg() -> str:
+    """Find FFmpeg executable on the system"""
+    # Check manual installation in ffmpeg-bin folder (for GitHub upload)
+    manual_paths = [
+        './ffmpeg-bin/ffmpeg.exe',  # Windows
+        './ffmpeg-bin/ffmpeg',      # Linux
+        './bin/ffmpeg'              # Local installation
+    ]
+
+    for path in manual_paths:
+        if os.path.exists(path):
+            return path
+
+    # Try shutil.which first (checks PATH)
+    ffmpeg_path = shutil.which('ffmpeg')
+    if ffmpeg_path:
+        return ffmpeg_path
+
+    # Try common system locations
+    system_paths = [
+        '/usr/bin/ffmpeg',           # Standard Linux
+        '/usr/local/bin/ffmpeg',     # Manual install
+        '/bin/ffmpeg',               # Some distros
+        '/opt/ffmpeg/bin/ffmpeg',    # Custom install
+    ]
+
+    for path in system_paths:
+        if os.path.exists(path):
+            return path
+
+    # Try to find in /nix/store (for Replit/NixOS). Store paths are flat
+    # "<hash>-<name>" directories, so a glob avoids walking the whole store.
+    if os.path.exists('/nix/store'):
+        for candidate in sorted(glob.glob('/nix/store/*-ffmpeg*/bin/ffmpeg')):
+            if os.access(candidate, os.X_OK):
+                return candidate
+
+    # Default fallback
+    return 'ffmpeg'
+
+
+def _run(args) -> str:
+    try:
+        result = subprocess.run(args, capture_output=True, text=True, timeout=10)
+        return result.stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f'Could not run {args[0]}: {e}')
+        return ''
+
+
+def probe_ffmpeg(path: str) -> Dict[str, Any]:
+    """Get the version and relevant encoders/filters of an FFmpeg executable"""
+    resolved = shutil.which(path) or path
+    if not os.path.exists(resolved):
+        logger.warning(f'FFmpeg not found (tried {path}); playback will fail until it is installed')
+        return {'path': path, 'mtime': None, 'version': None,
+                'libopus': False, 'ebur128': False, 'loudnorm': False}
+
+    version_output = _run([path, '-hide_banner', '-version'])
+    match = re.search(r'ffmpeg version (\S+)', version_output)
+    encoders = _run([path, '-hide_banner', '-encoders'])
+    filters = _run([path, '-hide_banner', '-filters'])
+
+    return {
+        'path': path,
+        'mtime': os.path.getmtime(resolved),
+        'version': match.group(1) if match else None,
+        'libopus': ' libopus ' in encoders,
+        'ebur128': ' ebur128 ' in filters,
+        'loudnorm': ' loudnorm ' in filters,
+    }
+
+
+def _load_cached() -> Optional[Dict[str, Any]]:
+    """Load a persisted probe result if the executable it points at is unchanged"""
+    try:
+        with open(FFMPEG_CACHE_PATH, encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    resolved = shutil.which(info.get('path', '')) or info.get('path', '')
+    if not os.path.exists(resolved) or os.path.getmtime(resolved) != info.get('mtime'):
+        return None
+    return info
+
+
+def _save_cached(info: Dict[str, Any]):
+    try:
+        os.makedirs(os.path.dirname(FFMPEG_CACHE_PATH) or '.', exist_ok=True)
+        with open(FFMPEG_CACHE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+    except OSError as e:
+        logger.warning(f'Could not persist FFmpeg probe: {e}')
+
+
+def get_ffmpeg_info(refresh: bool = False) -> Dict[str, Any]:
+    """Get the FFmpeg path and capabilities, detecting them only on first use.
+
+    Blocking on the first call (and on refresh); call it from a worker thread
+    at startup so playback never pays for the search.
+    """
+    global _ffmpeg_info
+    if _ffmpeg_info is not None and not refresh:
+        return _ffmpeg_info
+
+    with _lock:
+        if _ffmpeg_info is not None and not refresh:
+            return _ffmpeg_info
+
+        info = None if refresh else _load_cached()
+        if info is None:
+            info = probe_ffmpeg(_search_ffmpeg())
+            if info['mtime'] is not None:
+                _save_cached(info)
+
+        logger.info(f'Using FFmpeg {info.get("version") or "(unknown version)"} at {info["path"]}')
+        _ffmpeg_info = info
+        return info
+
+
+def find_ffmpeg() -> str:
+    """Get the FFmpeg executable path"""
+    return get_ffmpeg_info()['path']
+
+
+def refresh_ffmpeg() -> Dict[str, Any]:
+    """Discard the cached lookup and detect FFmpeg again, e.g. after installing it"""
+    return get_ffmpeg_info(refresh=True)
@@ -0,0 +1,287 @@
+"""
+Supervisor for the ffmpeg processes that feed voice playback
+"""
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional
+
+import discord
+
+from config import (
+    FFMPEG_MAX_PROCESSES, FFMPEG_MAX_PER_GUILD, FFMPEG_NICE, FFMPEG_CGROUP, FFMPEG_SAMPLE_INTERVAL,
+    FFMPEG_CPU_LIMIT, FFMPEG_MAX_RSS
+)
+from metrics import FFMPEG_SPAWN_TIME
+
+logger = logging.getLogger(__name__)
+
+CREATE_NO_WINDOW = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+# Niceness given to processes that keep exceeding FFMPEG_CPU_LIMIT
+THROTTLED_NICE = 19
+
+try:
+    _CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):  # No /proc accounting (e.g. Windows)
+    _CLOCK_TICKS = _PAGE_SIZE = None
+
+
+class FFmpegLimitError(discord.ClientException):
+    """Raised when starting ffmpeg would exceed a process cap"""
+
+
+class ManagedProcess:
+    """One supervised ffmpeg process and its latest resource sample"""
+
+    def __init__(self, process: subprocess.Popen, owner: Optional[Hashable]):
+        self.process = process
+        self.owner = owner
+        self.started_at = time.monotonic()
+        self.cpu_seconds = 0.0
+        self.cpu_percent = 0.0
+        self.rss_bytes = 0
+        self.throttled = False
+        self._over_limit = 0
+        self._sampled_at = self.started_at
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def sample(self) -> bool:
+        """Read CPU time and RSS from /proc; returns False if unavailable"""
+        if _CLOCK_TICKS is None:
+            return False
+        try:
+            with open(f'/proc/{self.pid}/stat', 'rb') as f:
+                # Fields after the parenthesised command name, which may contain spaces
+                fields = f.read().rsplit(b')', 1)[1].split()
+            with open(f'/proc/{self.pid}/statm', 'rb') as f:
+                resident_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return False
+
+        now = time.monotonic()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS  # utime + stime
+        elapsed = now - self._sampled_at
+        if elapsed > 0:
+            self.cpu_percent = (cpu_seconds - self.cpu_seconds) / elapsed * 100
+        self.cpu_seconds = cpu_seconds
+        self.rss_bytes = resident_pages * _PAGE_SIZE
+        self._sampled_at = now
+        return True
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'pid': self.pid,
+            'owner': self.owner,
+            'age': time.monotonic() - self.started_at,
+            'cpu_seconds': self.cpu_seconds,
+            'cpu_percent': self.cpu_percent,
+            'rss_bytes': self.rss_bytes,
+            'throttled': self.throttled,
+        }
+
+
+class FFmpegSupervisor:
+    """Launches, limits, monitors and reaps playback ffmpeg processes.
+
+    Processes are capped globally and per owner (guild), started at a lower
+    CPU priority and optionally moved into a cgroup. A background task
+    samples CPU and RSS; a process that keeps using more than FFMPEG_CPU_LIMIT
+    percent of a core is reniced to the lowest priority, and one above
+    FFMPEG_MAX_RSS is killed, so a broken stream in one guild can't starve
+    the others. Exited processes are reaped as soon as their source is
+    cleaned up, and by the sampler otherwise.
+    """
+
+    def __init__(self, max_processes: int = FFMPEG_MAX_PROCESSES, max_per_owner: int = FFMPEG_MAX_PER_GUILD,
+                 nice: int = FFMPEG_NICE, cgroup: Optional[str] = FFMPEG_CGROUP):
+        self.max_processes = max_processes
+        self.max_per_owner = max_per_owner
+        self.nice = nice
+        self.cgroup = cgroup
+        self._processes: Dict[int, ManagedProcess] = {}
+        self._lock = threading.Lock()
+        # Spawns between the cap check and Popen returning, in total and per owner
+        self._starting = 0
+        self._starting_by_owner: Dict[Optional[Hashable], int] = {}
+        self._monitor_task: Optional[asyncio.Task] = None
+        self.spawned = 0
+        self.rejected = 0
+
+    def spawn(self, args: List[str], owner: Optional[Hashable] = None, **subprocess_kwargs: Any) -> subprocess.Popen:
+        """Start an ffmpeg process, raising FFmpegLimitError if a cap is reached"""
+        self.reap()
+        with self._lock:
+            running = len(self._processes) + self._starting
+            if running >= self.max_processes:
+                self.rejected += 1
+                raise FFmpegLimitError(f'Too many ffmpeg processes running (max {self.max_processes})')
+            owned = sum(p.owner == owner for p in self._processes.values()) + self._starting_by_owner.get(owner, 0)
+            if owner is not None and owned >= self.max_per_owner:
+                self.rejected += 1
+                raise FFmpegLimitError(f'Too many ffmpeg processes for this server (max {self.max_per_owner})')
+            # Reserve the slot, so concurrent spawns still respect the caps
+            self._starting += 1
+            self._starting_by_owner[owner] = self._starting_by_owner.get(owner, 0) + 1
+
+        # fork/exec happens outside the lock, so the sampler, releases and
+        # other spawns never wait on it
+        process = None
+        try:
+            logger.debug(f'Spawning ffmpeg process with command: {args}')
+            with FFMPEG_SPAWN_TIME.time():
+                process = subprocess.Popen(args, creationflags=CREATE_NO_WINDOW, **subprocess_kwargs)
+        except FileNotFoundError:
+            raise discord.ClientException(f'{args[0]} was not found.') from None
+        except subprocess.SubprocessError as e:
+            raise discord.ClientException(f'Popen failed: {e.__class__.__name__}: {e}') from e
+        finally:
+            with self._lock:
+                self._starting -= 1
+                self._starting_by_owner[owner] -= 1
+                if not self._starting_by_owner[owner]:
+                    del self._starting_by_owner[owner]
+                if process is not None:
+                    self._processes[process.pid] = ManagedProcess(process, owner)
+                    self.spawned += 1
+
+        self._set_priority(process.pid, self.nice)
+        self._join_cgroup(process.pid)
+        return process
+
+    def release(self, process: subprocess.Popen):
+        """Forget a process that has been killed and waited for"""
+        with self._lock:
+            self._processes.pop(process.pid, None)
+
+    def reap(self) -> int:
+        """Collect exit statuses of finished processes so none linger as zombies"""
+        with self._lock:
+            finished = [pid for pid, managed in self._processes.items() if managed.process.poll() is not None]
+            for pid in finished:
+                del self._processes[pid]
+        return len(finished)
+
+    @staticmethod
+    def _set_priority(pid: int, nice: int) -> bool:
+        if not hasattr(os, 'setpriority'):
+            return False
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, nice)
+            return True
+        except OSError as e:
+            logger.debug(f'Could not renice ffmpeg {pid}: {e}')
+            return False
+
+    def _join_cgroup(self, pid: int):
+        """Move a process into the configured cgroup (v2), if any"""
+        if not self.cgroup:
+            return
+        try:
+            with open(os.path.join(self.cgroup, 'cgroup.procs'), 'w') as f:
+                f.write(str(pid))
+        except OSError as e:
+            logger.warning(f'Could not move ffmpeg {pid} into cgroup {self.cgroup}: {e}')
+            self.cgroup = None
+
+    def sample(self):
+        """Refresh resource usage and enforce the CPU and memory limits"""
+        self.reap()
+        with self._lock:
+            processes = list(self._processes.values())
+
+        for managed in processes:
+            if not managed.sample():
+                continue
+            if FFMPEG_MAX_RSS and managed.rss_bytes > FFMPEG_MAX_RSS:
+                logger.warning(f'Killing ffmpeg {managed.pid} (owner {managed.owner}): '
+                               f'using {managed.rss_bytes // (1024 * 1024)} MiB')
+                managed.process.kill()
+                continue
+            if managed.cpu_percent > FFMPEG_CPU_LIMIT:
+                managed._over_limit += 1
+                # Two samples in a row, so one busy startup burst isn't punished
+                if managed._over_limit >= 2 and not managed.throttled:
+                    logger.warning(f'Throttling ffmpeg {managed.pid} (owner {managed.owner}): '
+                                   f'{managed.cpu_percent:.0f}% CPU')
+                    managed.throttled = self._set_priority(managed.pid, THROTTLED_NICE)
+            else:
+                managed._over_limit = 0
+
+    async def start(self):
+        """Start sampling processes in the background"""
+        if self._monitor_task is None:
+            self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(FFMPEG_SAMPLE_INTERVAL)
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f'FFmpeg sampling failed: {e}')
+
+    async def stop(self):
+        """Stop sampling"""
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            self._monitor_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Get per-process CPU/RSS and totals"""
+        with self._lock:
+            processes = [managed.as_dict() for managed in self._processes.values()]
+        return {
+            'running': len(processes),
+            'spawned': self.spawned,
+            'rejected': self.rejected,
+            'cpu_percent': sum(p['cpu_percent'] for p in processes),
+            'rss_bytes': sum(p['rss_bytes'] for p in processes),
+            'processes': processes,
+        }
+
+
+class _SupervisedMixin:
+    """Routes an FFmpegAudio source's process through the supervisor"""
+
+    def _init_supervision(self, owner: Optional[Hashable], supervisor: Optional[FFmpegSupervisor]):
+        self._owner = owner
+        self._supervisor = supervisor or ffmpeg_supervisor
+
+    def _spawn_process(self, args: Any, **subprocess_kwargs: Any) -> subprocess.Popen:
+        return self._supervisor.spawn(args, owner=self._owner, **subprocess_kwargs)
+
+    def _kill_process(self) -> None:
+        super()._kill_process()
+        process = getattr(self, '_process', None)
+        if process:
+            self._supervisor.release(process)
+
+
+class SupervisedPCMAudio(_SupervisedMixin, discord.FFmpegPCMAudio):
+    """discord.FFmpegPCMAudio whose ffmpeg process is supervised"""
+
+    def __init__(self, source: str, *, owner: Optional[Hashable] = None,
+                 supervisor: Optional[FFmpegSupervisor] = None, **kwargs: Any):
+        self._init_supervision(owner, supervisor)
+        super().__init__(source, **kwargs)
+
+
+class SupervisedOpusAudio(_SupervisedMixin, discord.FFmpegOpusAudio):
+    """discord.FFmpegOpusAudio whose ffmpeg process is supervised"""
+
+    def __init__(self, source: str, *, owner: Optional[Hashable] = None,
+                 supervisor: Optional[FFmpegSupervisor] = None, **kwargs: Any):
+        self._init_supervision(owner, supervisor)
+        super().__init__(source, **kwargs)
+
+
+# Shared by every guild's MusicPlayer
+ffmpeg_supervisor = FFmpegSupervisor()
@@ -0,0 +1,107 @@
+"""
+Health, readiness and metrics endpoints served from the bot's own event loop
+"""
+import logging
+import math
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+from discord.ext import commands
+
+from config import KEEP_ALIVE_PORT
+from metrics import registry, loop_lag_monitor
+
+logger = logging.getLogger(__name__)
+
+
+def _seconds(value: float) -> Optional[float]:
+    """JSON-safe latency; None until the first heartbeat is acknowledged"""
+    return None if value is None or math.isinf(value) or math.isnan(value) else round(value, 4)
+
+
+class HealthServer:
+    """aiohttp server running on the bot's loop.
+
+    Endpoints:
+        /         plain "Bot is running!" for uptime pings
+        /healthz  liveness; answering at all means the event loop is turning
+        /readyz   200 once every shard of this process is connected, 503 before
+                  that or while any shard is disconnected
+        /metrics  Prometheus text format (see metrics.py)
+
+    Because it shares the loop with the gateway, a reply also shows the loop
+    is not blocked, and the state it reports is read without locks.
+    """
+
+    def __init__(self, bot: commands.Bot, host: str = '0.0.0.0', port: int = KEEP_ALIVE_PORT):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+        self.app = web.Application()
+        self.app.router.add_get('/', self.home)
+        self.app.router.add_get('/healthz', self.healthz)
+        self.app.router.add_get('/readyz', self.readyz)
+        self.app.router.add_get('/metrics', self.metrics)
+
+    def status(self) -> Dict[str, Any]:
+        """Get the gateway, shard and voice state of this process"""
+        bot = self.bot
+        shards = {}
+        for shard_id, shard in getattr(bot, 'shards', {}).items():
+            shards[str(shard_id)] = {
+                'connected': not shard.is_closed(),
+                'latency': _seconds(shard.latency),
+                'rate_limited': shard.is_ws_ratelimited(),
+            }
+        voice_clients = bot.voice_clients
+        ready = (bot.is_ready() and not bot.is_closed()
+                 and bool(shards) and all(shard['connected'] for shard in shards.values()))
+        return {
+            'ready': ready,
+            'user': str(bot.user) if bot.user else None,
+            'guilds': len(bot.guilds),
+            'shard_count': bot.shard_count,
+            'shards': shards,
+            'voice': {
+                'clients': len(voice_clients),
+                'connected': sum(vc.is_connected() for vc in voice_clients),
+                'playing': sum(vc.is_playing() for vc in voice_clients),
+            },
+            'loop_lag': round(loop_lag_monitor.last, 4),
+        }
+
+    async def home(self, request: web.Request) -> web.Response:
+        return web.Response(text='Bot is running!')
+
+    async def healthz(self, request: web.Request) -> web.Response:
+        return web.json_response({'status': 'ok', 'loop_lag': round(loop_lag_monitor.last, 4)})
+
+    async def readyz(self, request: web.Request) -> web.Response:
+        status = self.status()
+        return web.json_response(status, status=200 if status['ready'] else 503)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=registry.render().encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def start(self):
+        """Start listening; a port already in use is logged, not raised"""
+        if self._runner is not None:
+            return
+        runner = web.AppRunner(self.app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except OSError as e:
+            logger.error(f'Health server could not listen on port {self.port}: {e}')
+            await runner.cleanup()
+            return
+        self._runner = runner
+        logger.info(f'Health server listening on port {self.port}')
+
+    async def stop(self):
+        """Stop listening"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
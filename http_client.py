@@ -0,0 +1,185 @@
+"""
+Bot-wide HTTP client: one pooled aiohttp session with timeouts and retries
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+from config import (HTTP_POOL_SIZE, HTTP_POOL_PER_HOST, HTTP_KEEPALIVE, HTTP_TIMEOUT,
+                    HTTP_CONNECT_TIMEOUT, HTTP_RETRIES, HTTP_RETRY_BACKOFF)
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth another attempt; anything else is returned to the caller
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HTTPClient:
+    """Shared aiohttp session for outbound requests.
+
+    Connections are kept alive and reused across commands, so repeat requests
+    to a host skip DNS, TCP and TLS setup. Connection errors, timeouts, 429
+    and 5xx responses are retried with exponential backoff and jitter,
+    honouring Retry-After when the server sends one.
+    """
+
+    def __init__(self, limit: int = HTTP_POOL_SIZE, limit_per_host: int = HTTP_POOL_PER_HOST,
+                 keepalive: float = HTTP_KEEPALIVE, timeout: float = HTTP_TIMEOUT,
+                 connect_timeout: float = HTTP_CONNECT_TIMEOUT, retries: int = HTTP_RETRIES,
+                 backoff: float = HTTP_RETRY_BACKOFF):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive = keepalive
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared session, created on first use inside the running loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    def _retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), 30.0)
+            except ValueError:
+                pass
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.0)
+
+    async def request_json(self, method: str, url: str, **kwargs: Any) -> Tuple[int, Any]:
+        """Send a request and get (status, parsed JSON body or None).
+
+        Only use with idempotent requests; every attempt is sent in full.
+        Raises the last error once retries are exhausted.
+        """
+        self.requests += 1
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                async with self.session.request(method, url, **kwargs) as resp:
+                    if resp.status in RETRY_STATUSES and not last:
+                        delay = self._retry_delay(attempt, resp.headers.get('Retry-After'))
+                        logger.debug(f'{method} {resp.url.host} returned {resp.status}; retrying in {delay:.2f}s')
+                    else:
+                        try:
+                            data = await resp.json(content_type=None)
+                        except ValueError:
+                            data = None
+                        return resp.status, data
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if last:
+                    self.failed += 1
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.debug(f'{method} {url.split("?", 1)[0]} failed ({type(e).__name__}); retrying in {delay:.2f}s')
+            self.retried += 1
+            await asyncio.sleep(delay)
+
+    async def get_json(self, url: str, params: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Tuple[int, Any]:
+        """GET a URL and get (status, parsed JSON body or None)"""
+        return await self.request_json('GET', url, params=params, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get request counters and pool usage"""
+        connector = self._session.connector if self._session is not None and not self._session.closed else None
+        # aiohttp has no public pool size; its private map may change between versions
+        idle = getattr(connector, '_conns', None)
+        try:
+            idle_connections = sum(len(conns) for conns in idle.values()) if idle else 0
+        except (AttributeError, TypeError):
+            idle_connections = 0
+        return {
+            'requests': self.requests,
+            'retried': self.retried,
+            'failed': self.failed,
+            'idle_connections': idle_connections,
+        }
+
+    async def close(self):
+        """Close the session and its pooled connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# Shared by the whole bot
+http_client = HTTPClient()
+
+
+async def _benchmark(requests: int, concurrency: int):
+    """Latency of a session per request vs the shared pooled client against a local stub server"""
+    from aiohttp import web
+
+    async def handler(request):
+        return web.json_response({'ok': True})
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f'http://127.0.0.1:{port}/'
+
+    async def per_request():
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as resp:
+                await resp.json()
+
+    client = HTTPClient()
+
+    async def pooled():
+        await client.get_json(url)
+
+    async def run(name, call):
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                await call()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        print(f'{name:12} {requests / elapsed:8.0f} req/s  '
+              f'p50 {latencies[len(latencies) // 2] * 1000:6.2f}ms  '
+              f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.2f}ms')
+
+    try:
+        await run('per-request', per_request)
+        await run('pooled', pooled)
+        print(f'pooled client: {client.stats()}')
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the shared HTTP client against a local stub server')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(_benchmark(args.requests, args.concurrency))
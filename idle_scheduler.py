@@ -0,0 +1,101 @@
+"""
+Deadline scheduler for idle voice disconnects, driven by a single timer
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """Runs an async callback for a key once its deadline passes.
+
+    Deadlines live in a heap, with one loop timer armed for the earliest of
+    them, so there is no sleeping task per key. Rescheduling or cancelling a
+    key leaves its old heap entry behind and it is skipped when popped; the
+    heap is rebuilt when such stale entries outnumber the live ones, so
+    memory stays proportional to the number of scheduled keys.
+    """
+
+    def __init__(self, callback: Callable[[Hashable], Awaitable[None]]):
+        self.callback = callback
+        self._deadlines: Dict[Hashable, float] = {}
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._counter = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at: Optional[float] = None
+        self._running: Set[asyncio.Task] = set()
+
+    def schedule(self, key: Hashable, delay: float):
+        """Run the callback for a key after delay seconds, replacing any earlier deadline"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + delay
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._counter), key))
+        if len(self._heap) > 2 * len(self._deadlines) + 16:
+            self._compact()
+        self._arm(loop)
+
+    def cancel(self, key: Hashable):
+        """Forget a key's deadline"""
+        self._deadlines.pop(key, None)
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        """Get a key's deadline in loop time, if it has one"""
+        return self._deadlines.get(key)
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def _compact(self):
+        self._heap = [(deadline, next(self._counter), key) for key, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def _arm(self, loop: asyncio.AbstractEventLoop):
+        """Point the single timer at the earliest live deadline"""
+        while self._heap and self._deadlines.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            self._disarm()
+            return
+        earliest = self._heap[0][0]
+        if self._timer_at == earliest:
+            return
+        self._disarm()
+        self._timer_at = earliest
+        self._timer = loop.call_at(earliest, self._fire, loop)
+
+    def _disarm(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        self._timer_at = None
+
+    def _fire(self, loop: asyncio.AbstractEventLoop):
+        self._timer = None
+        self._timer_at = None
+        now = loop.time()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) != deadline:
+                continue  # Rescheduled or cancelled
+            del self._deadlines[key]
+            task = loop.create_task(self._run(key))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        self._arm(loop)
+
+    async def _run(self, key: Hashable):
+        try:
+            await self.callback(key)
+        except Exception as e:
+            logger.error(f'Scheduled callback for {key} failed: {e}')
+
+    def stop(self):
+        """Drop all deadlines and the timer"""
+        self._deadlines.clear()
+        self._heap.clear()
+        self._disarm()
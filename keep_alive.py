@@ -1,15 +1,38 @@
-from flask import Flask
+"""
+Legacy threaded Flask keep-alive server.
+
+main.py serves "/", "/healthz", "/readyz" and "/metrics" from its own event
+loop (see health_server.py), so this is only for scripts that need a
+keep-alive without running the bot. Flask is optional: pip install flask.
+"""
+import logging
 import threading
 
-app = Flask("")
+try:
+    from flask import Flask, Response
+except ImportError:  # Only needed by keep_alive()
+    Flask = None
 
-@app.route("/")
-def home():
-    return "Bot is running!"
+from config import KEEP_ALIVE_PORT
+from metrics import registry
 
 def run():
-    app.run(host="0.0.0.0", port=8080)
+    app = Flask("")
+    # Uptime pings and scrapes would otherwise log a line each
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    @app.route("/")
+    def home():
+        return "Bot is running!"
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    app.run(host="0.0.0.0", port=KEEP_ALIVE_PORT)
 
 def keep_alive():
-    t = threading.Thread(target=run)
+    if Flask is None:
+        raise ImportError("keep_alive needs Flask; install it with `pip install flask`")
+    t = threading.Thread(target=run, daemon=True)
     t.start()
@@ -0,0 +1,108 @@
+"""
+Process-wide music library shared by every guild's music player
+"""
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+from config import LIBRARY_POLL_INTERVAL, LIBRARY_WATCH_DEBOUNCE
+from music_library import MusicLibrary
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Fall back to polling
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = logging.getLogger(__name__)
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    """Forwards filesystem events from the watchdog thread to the event loop"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, changed: asyncio.Event):
+        self._loop = loop
+        self._changed = changed
+
+    def on_any_event(self, event):
+        self._loop.call_soon_threadsafe(self._changed.set)
+
+
+class LibraryService:
+    """Owns the single MusicLibrary and keeps it in sync with the music directory.
+
+    The persisted index is loaded immediately so lookups work right away; the
+    rescan runs on a worker thread after startup and whenever the directory
+    changes (inotify via watchdog when installed, polling otherwise).
+    """
+
+    def __init__(self, music_directory: str = "music"):
+        self.library = MusicLibrary(music_directory, scan=False)
+        self._refresh_lock = threading.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+        self._observer = None
+
+    async def start(self):
+        """Rescan in the background and start watching for changes"""
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def refresh(self):
+        """Rescan the music directory without blocking the event loop"""
+        await asyncio.get_running_loop().run_in_executor(None, self._refresh_blocking)
+
+    def _refresh_blocking(self):
+        # Only one rescan at a time; the library swaps its index atomically
+        with self._refresh_lock:
+            before = len(self.library.tracks)
+            self.library.refresh_library()
+            after = len(self.library.tracks)
+        if before != after:
+            logger.info(f'Music library now has {after} songs')
+
+    async def _watch(self):
+        try:
+            await self.refresh()
+            if Observer is not None:
+                await self._watch_events()
+            else:
+                await self._poll()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f'Music library watcher stopped: {e}')
+
+    async def _watch_events(self):
+        changed = asyncio.Event()
+        self._observer = Observer()
+        self._observer.schedule(_ChangeHandler(asyncio.get_running_loop(), changed),
+                                self.library.music_directory, recursive=True)
+        self._observer.daemon = True
+        self._observer.start()
+        logger.info('Watching music library for changes')
+
+        while True:
+            await changed.wait()
+            # Let bursts of events (e.g. copying an album) settle first
+            await asyncio.sleep(LIBRARY_WATCH_DEBOUNCE)
+            changed.clear()
+            await self.refresh()
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(LIBRARY_POLL_INTERVAL)
+            await self.refresh()
+
+    async def stop(self):
+        """Stop watching for changes"""
+        if self._watch_task:
+            self._watch_task.cancel()
+            self._watch_task = None
+        if self._observer:
+            self._observer.stop()
+            self._observer = None
+
+
+library_service = LibraryService()
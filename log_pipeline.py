@@ -0,0 +1,250 @@
+"""
+Queue-based logging: records are handed to a background writer thread
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (LOG_LEVEL, LOG_FILE, LOG_FORMAT, LOG_MAX_BYTES, LOG_ROTATE_INTERVAL, LOG_BACKUP_COUNT,
+                    LOG_QUEUE_SIZE, LOG_SAMPLE_EVERY)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Fields attached to every record logged while handling an interaction
+log_context: 'contextvars.ContextVar[Dict[str, Any]]' = contextvars.ContextVar('log_context', default={})
+
+# Standard LogRecord attributes, so JSON output only adds the extra ones
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class ContextFilter(logging.Filter):
+    """Copies log_context (guild, command...) onto records as they are logged"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in N records below WARNING from each call site of the configured loggers"""
+
+    def __init__(self, every: Dict[str, int]):
+        super().__init__()
+        self.every = {name: n for name, n in every.items() if n > 1}
+        self._seen: Dict[Tuple[str, int], int] = {}
+        self.suppressed = 0
+
+    def _rate(self, name: str) -> int:
+        while name:
+            if name in self.every:
+                return self.every[name]
+            name = name.rpartition('.')[0]
+        return 1
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.every:
+            return True
+        rate = self._rate(record.name)
+        if rate == 1:
+            return True
+        key = (record.name, record.lineno)
+        count = self._seen.get(key, 0)
+        self._seen[key] = count + 1
+        if count % rate:
+            self.suppressed += 1
+            return False
+        record.sampled = rate
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the writer falls behind, instead of blocking"""
+
+    def __init__(self, log_queue: queue.SimpleQueue, max_size: int):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Fix the message now, as its arguments may change; formatting (time,
+        # traceback text, JSON) is left to the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        # SimpleQueue has no bound of its own but is much cheaper to put to
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """One JSON object per record, with any extra fields (guild_id, command...)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotates when the file reaches max_bytes or is older than interval seconds"""
+
+    def __init__(self, filename: str, max_bytes: int, interval: float, backup_count: int):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.interval and time.time() >= self.rollover_at and os.path.exists(self.baseFilename):
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
+
+class LogPipeline:
+    """Queue handler on the root logger, with console and file output on a listener thread"""
+
+    def __init__(self, handlers: List[logging.Handler], queue_size: int = LOG_QUEUE_SIZE,
+                 sample_every: Optional[Dict[str, int]] = None):
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.handler = DroppingQueueHandler(self.queue, queue_size)
+        self.handler.addFilter(ContextFilter())
+        self.sampler = SamplingFilter(sample_every or {})
+        self.handler.addFilter(self.sampler)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        """Write every queued record and stop the writer thread"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def stats(self) -> Dict[str, int]:
+        return {'queued': self.queue.qsize(), 'dropped': self.handler.dropped, 'sampled_out': self.sampler.suppressed}
+
+
+_pipeline: Optional[LogPipeline] = None
+_lock = threading.Lock()
+
+
+def setup_logging(level: str = LOG_LEVEL, log_file: Optional[str] = LOG_FILE, fmt: str = LOG_FORMAT) -> LogPipeline:
+    """Route all logging through one background writer; safe to call more than once"""
+    global _pipeline
+    with _lock:
+        if _pipeline is not None:
+            return _pipeline
+
+        formatter = JSONLinesFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT)
+        handlers: List[logging.Handler] = [logging.StreamHandler()]
+        if log_file:
+            handlers.append(SizeAndTimeRotatingFileHandler(log_file, LOG_MAX_BYTES, LOG_ROTATE_INTERVAL,
+                                                           LOG_BACKUP_COUNT))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        _pipeline = LogPipeline(handlers, sample_every=LOG_SAMPLE_EVERY)
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_pipeline.handler)
+        _pipeline.start()
+        # The writer is a daemon thread; flush what it holds on any normal exit
+        atexit.register(shutdown_logging)
+        return _pipeline
+
+
+def shutdown_logging():
+    """Flush queued records; call before the process exits"""
+    global _pipeline
+    with _lock:
+        if _pipeline is not None:
+            logging.getLogger().removeHandler(_pipeline.handler)
+            _pipeline.stop()
+            for handler in _pipeline.listener.handlers:
+                handler.close()
+            _pipeline = None
+
+
+class _StallingFileHandler(logging.FileHandler):
+    """FileHandler that stalls every so often, like a busy or network disk"""
+
+    def __init__(self, path: str, stall: float, every: int = 100):
+        super().__init__(path, encoding='utf-8')
+        self.stall = stall
+        self.every = every
+        self._count = 0
+
+    def emit(self, record: logging.LogRecord):
+        self._count += 1
+        if self.stall and self._count % self.every == 0:
+            time.sleep(self.stall)
+        super().emit(record)
+
+
+def _benchmark(records: int, directory: str, stall: float):
+    """Cost per log call on the calling thread: direct FileHandler vs the queue pipeline"""
+    for name in ('file handler', 'queue pipeline'):
+        path = os.path.join(directory, f'bench-{name.replace(" ", "-")}.log')
+        logger = logging.getLogger(f'bench.{name}')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        file_handler = _StallingFileHandler(path, stall)
+        file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        pipeline = None
+        if name == 'file handler':
+            logger.addHandler(file_handler)
+        else:
+            pipeline = LogPipeline([file_handler], queue_size=records + 1)
+            pipeline.start()
+            logger.addHandler(pipeline.handler)
+
+        costs = []
+        for i in range(records):
+            before = time.perf_counter()
+            logger.info(f'Now playing: song {i} in guild 123456789')
+            costs.append(time.perf_counter() - before)
+            # Log calls are spread out between other work on a real loop
+            time.sleep(0.0002)
+        if pipeline is not None:
+            pipeline.stop()
+        file_handler.close()
+        logger.handlers.clear()
+        costs.sort()
+        print(f'{name:15} median {costs[len(costs) // 2] * 1e6:7.1f}us  '
+              f'p99 {costs[int(len(costs) * 0.99)] * 1e6:8.1f}us  max {costs[-1] * 1e3:6.2f}ms')
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    parser = argparse.ArgumentParser(description='Measure per-call logging cost on the calling thread')
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--stall', type=float, default=0.005, help='seconds the disk stalls every 100 writes')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        _benchmark(args.records, directory, args.stall)
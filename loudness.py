@@ -0,0 +1,174 @@
+"""
+Background loudness analysis for ReplayGain-style normalization
+"""
+import asyncio
+import logging
+import os
+import re
+import shlex
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from config import (
+    LOUDNESS_NORMALIZATION, LOUDNESS_TARGET_LUFS, LOUDNESS_MAX_GAIN_DB, LOUDNESS_WORKERS,
+    LOUDNESS_TIMEOUT
+)
+from ffmpeg_locator import get_ffmpeg_info
+from metadata_store import MetadataStore, metadata_store as default_metadata_store, track_key
+
+logger = logging.getLogger(__name__)
+
+_INTEGRATED_RE = re.compile(r'Integrated loudness:\s*I:\s*(-?[\d.]+|-inf)\s*LUFS')
+
+
+def measure_integrated_loudness(ffmpeg_path: str, source: str, before_options: str = '',
+                                timeout: float = LOUDNESS_TIMEOUT,
+                                started: Optional[Callable[[subprocess.Popen], None]] = None) -> Optional[float]:
+    """Measure a source's integrated loudness in LUFS with ffmpeg's ebur128 filter.
+
+    Blocking; ffmpeg runs at low priority so it never competes with live
+    playback. `started` is given the process, so the caller can kill it.
+    """
+    args = [
+        ffmpeg_path, '-nostdin', '-hide_banner', *shlex.split(before_options),
+        '-i', source, '-vn', '-af', 'ebur128=framelog=quiet', '-f', 'null', '-'
+    ]
+    try:
+        process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                                   preexec_fn=(lambda: os.nice(10)) if hasattr(os, 'nice') else None)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if started is not None:
+        started(process)
+    try:
+        _, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        return None
+
+    matches = _INTEGRATED_RE.findall(stderr or '')
+    if not matches or matches[-1] == '-inf':
+        return None
+    return float(matches[-1])
+
+
+def gain_for_loudness(lufs: Optional[float]) -> float:
+    """Get the linear gain that brings a track to the target loudness"""
+    if lufs is None or not LOUDNESS_NORMALIZATION:
+        return 1.0
+    gain_db = max(-LOUDNESS_MAX_GAIN_DB, min(LOUDNESS_MAX_GAIN_DB, LOUDNESS_TARGET_LUFS - lufs))
+    return 10 ** (gain_db / 20)
+
+
+class LoudnessAnalyzer:
+    """Analyses each track once, with a low-priority ffmpeg, and stores the result.
+
+    Only local files are measured: library tracks directly, YouTube tracks
+    from the copy the Opus cache downloads once they are hot (see
+    analyse_file), so no track is fetched a second time just to be measured.
+    """
+
+    def __init__(self, metadata_store: Optional[MetadataStore] = None, max_workers: int = LOUDNESS_WORKERS):
+        self.metadata_store = metadata_store or default_metadata_store
+        self.max_workers = max_workers
+        # Threads only wait on ffmpeg, which does the work in its own process
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pending: Dict[str, asyncio.Task] = {}
+        # Running ffmpeg processes, killed on cancel and shutdown
+        self._processes: Set[subprocess.Popen] = set()
+        self._processes_lock = threading.Lock()
+
+    async def load(self, song: Dict[str, Any]):
+        """Fill in song['loudness'] from the metadata cache if it has been analysed"""
+        if not LOUDNESS_NORMALIZATION or 'loudness' in song:
+            return
+        key = track_key(song)
+        if key:
+            loudness = await self.metadata_store.get_loudness(key)
+            if loudness is not None:
+                song['loudness'] = loudness
+
+    def schedule(self, song: Dict[str, Any], source: str, before_options: str = ''):
+        """Analyse a song's local file in the background unless it already has been"""
+        if not LOUDNESS_NORMALIZATION or song.get('loudness') is not None:
+            return
+        key = track_key(song)
+        if not key or key in self._pending:
+            return
+        task = asyncio.create_task(self._analyse(key, source, before_options))
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+    async def analyse_file(self, song: Dict[str, Any], path: str) -> Optional[float]:
+        """Measure a local copy of a song now, store the result and set song['loudness']"""
+        key = track_key(song)
+        if not key:
+            return None
+        lufs = await self._analyse(key, path, '')
+        if lufs is not None:
+            song['loudness'] = lufs
+        return lufs
+
+    async def _analyse(self, key: str, source: str, before_options: str) -> Optional[float]:
+        ffmpeg = get_ffmpeg_info()
+        if not ffmpeg.get('ebur128'):
+            return None
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='loudness')
+
+        processes: List[subprocess.Popen] = []
+
+        def started(process: subprocess.Popen):
+            processes.append(process)
+            with self._processes_lock:
+                self._processes.add(process)
+
+        loop = asyncio.get_running_loop()
+        try:
+            lufs = await loop.run_in_executor(
+                self._pool, measure_integrated_loudness, ffmpeg['path'], source, before_options,
+                LOUDNESS_TIMEOUT, started
+            )
+        except asyncio.CancelledError:
+            for process in processes:
+                _kill(process)
+            raise
+        except Exception as e:
+            logger.warning(f'Loudness analysis failed for {key}: {e}')
+            return None
+        finally:
+            with self._processes_lock:
+                self._processes.difference_update(processes)
+
+        if lufs is not None:
+            await self.metadata_store.save_loudness(key, lufs)
+            logger.debug(f'Measured {lufs:.1f} LUFS for {key}')
+        return lufs
+
+    def shutdown(self):
+        """Cancel pending analyses and kill running ffmpeg processes"""
+        for task in list(self._pending.values()):
+            task.cancel()
+        with self._processes_lock:
+            processes = list(self._processes)
+        for process in processes:
+            _kill(process)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def _kill(process: subprocess.Popen):
+    # The analysis thread reaps it in communicate()
+    if process.poll() is None:
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+
+# Shared by every guild's MusicPlayer
+loudness_analyzer = LoudnessAnalyzer()
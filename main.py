@@ -1,3 +1,6 @@
+# Imported first so its clock covers every other import
+from startup_profile import startup_profile
+import aiohttp
 import discord
 from discord.ext import commands
 from discord import app_commands
@@ -5,12 +8,29 @@ import asyncio
 import logging
 import os
 import random
-import aiohttp
 import json
+import signal
 from datetime import datetime
-from config import BOT_TOKEN, FFMPEG_OPTIONS
+from config import BOT_TOKEN, FFMPEG_OPTIONS, VOICE_TIMEOUT, WEATHER_API_KEY, KEEP_ALIVE_ENABLED
 from music_player import MusicPlayer
-from utils import is_admin, setup_logging, create_error_embed, create_info_embed, create_success_embed
+from library_service import library_service
+from health_server import HealthServer
+from ffmpeg_locator import get_ffmpeg_info
+from ffmpeg_supervisor import ffmpeg_supervisor
+from audio_worker import audio_workers
+from extractor import extractor
+from loudness import loudness_analyzer
+from metadata_store import metadata_store
+from audio_gain import load_numpy
+from idle_scheduler import DeadlineScheduler
+from http_client import http_client
+from weather_cache import weather_cache, WeatherUnavailable
+from state_store import state_store, EXCLUDED, SETTINGS, QUEUE
+from sharding import shard_options
+from command_sync import command_sync
+from metrics import registry, loop_lag_monitor, TimedCommandTree
+from log_pipeline import shutdown_logging
+from utils import is_admin, setup_logging, create_error_embed, create_info_embed, create_success_embed, format_duration, parse_timestamp
 
 # Setup logging
 setup_logging()
@@ -22,12 +42,105 @@ intents.message_content = True
 intents.voice_states = True
 intents.guilds = True
 
-# Bot instance
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Bot instance; runs all shards of this process over their own gateway connections
+bot = commands.AutoShardedBot(command_prefix='!', intents=intents, tree_cls=TimedCommandTree, **shard_options())
 
-# Music players for each guild
+# Music players for each guild. Each process only receives events for guilds
+# on its own shards, so this (like the lazily loaded guild state) only ever
+# holds this process's guilds.
 music_players = {}
 
+# Gauges are read when /metrics is scraped, so they cost nothing in between
+def _queue_lengths():
+    return [len(player.queue) for player in list(music_players.values())]
+
+registry.gauge('discord_voice_clients', 'Connected voice clients', function=lambda: len(bot.voice_clients))
+registry.gauge('music_players', 'Guilds with a music player', function=lambda: len(music_players))
+registry.gauge('music_queue_songs', 'Songs queued across all guilds', function=lambda: sum(_queue_lengths()))
+registry.gauge('music_queue_songs_max', 'Longest queue of any guild', function=lambda: max(_queue_lengths(), default=0))
+def _ffmpeg_total(key: str) -> float:
+    # Includes the ffmpeg processes audio workers run and supervise themselves
+    workers = audio_workers.ffmpeg_stats() if audio_workers else {}
+    return ffmpeg_supervisor.stats()[key] + workers.get(key, 0)
+
+registry.gauge('ffmpeg_processes', 'Running playback ffmpeg processes', function=lambda: _ffmpeg_total('running'))
+registry.gauge('ffmpeg_cpu_percent', 'CPU use of playback ffmpeg processes at the last sample',
+               function=lambda: _ffmpeg_total('cpu_percent'))
+registry.gauge('ffmpeg_rss_bytes', 'Memory of playback ffmpeg processes at the last sample',
+               function=lambda: _ffmpeg_total('rss_bytes'))
+registry.gauge('audio_worker_streams', 'Streams playing on each audio worker', ['worker'],
+               function=lambda: [((str(i),), w['streams']) for i, w in enumerate(audio_workers.stats() if audio_workers else [])])
+registry.gauge('startup_phase_seconds', 'Duration of each startup phase of this process', ['phase'],
+               function=lambda: [((phase,), seconds) for phase, seconds in startup_profile.durations().items()])
+registry.gauge('shard_latency_seconds', 'Gateway heartbeat latency per shard', ['shard'],
+               function=lambda: [((str(shard_id),), latency) for shard_id, latency in bot.latencies])
+
+async def expire_idle_voice(guild_id: int):
+    """Leave voice and free the music player of a guild idle for VOICE_TIMEOUT"""
+    guild = bot.get_guild(guild_id)
+    voice_client = guild.voice_client if guild else None
+    player = music_players.get(guild_id)
+
+    # Still playing to someone; the player restarts the countdown when it stops
+    if voice_client and voice_client.is_connected() and player and player.is_active() \
+            and has_listeners(voice_client.channel):
+        return
+
+    if player:
+        await player.cleanup()
+        if music_players.get(guild_id) is player:
+            del music_players[guild_id]
+    if voice_client:
+        await voice_client.disconnect()
+    await state_store.unload(guild_id)
+    logger.info(f'Released idle voice state for guild {guild_id}')
+
+# One timer for every guild's idle countdown
+idle_voice = DeadlineScheduler(expire_idle_voice)
+
+# /healthz, /readyz and /metrics on the keep-alive port, served from this loop
+health_server = HealthServer(bot)
+
+async def get_music_player(guild: discord.Guild, voice_client: discord.VoiceClient) -> MusicPlayer:
+    """Get a guild's music player, creating it with the guild's saved settings on first use"""
+    player = music_players.get(guild.id)
+    if player is None:
+        state = await state_store.get(guild.id)
+        # Another command may have created it while the state loaded
+        player = music_players.get(guild.id)
+    if player is not None:
+        player.voice_client = voice_client
+        return player
+
+    player = MusicPlayer(voice_client)
+    if 'volume' in state.settings:
+        player.set_volume(state.settings['volume'])
+    player.on_idle = lambda: idle_voice.schedule(guild.id, VOICE_TIMEOUT)
+    player.on_queue_change = lambda: state_store.mark_dirty(guild.id, QUEUE)
+    state.queue_source = player.snapshot
+    music_players[guild.id] = player
+    return player
+
+async def release_guild_state(guild_id: int):
+    """Drop a guild's state from memory when no music player is using it"""
+    if guild_id not in music_players:
+        await state_store.unload(guild_id, keep=lambda: guild_id in music_players)
+
+async def restore_queue(guild_id: int, player: MusicPlayer) -> int:
+    """Queue the songs saved before the last restart and resume playing them"""
+    state = await state_store.get(guild_id)
+    snapshot = state.queue
+    if not snapshot or player.current_song or player.queue:
+        return 0
+    restored = await player.restore(snapshot)
+    if restored:
+        logger.info(f'Restored {restored} queued songs in guild {guild_id}')
+    return restored
+
+def has_listeners(channel) -> bool:
+    """Check whether anyone other than bots is in a voice channel"""
+    return any(not member.bot for member in channel.members)
+
 # Bible verses for /truth command
 BIBLE_VERSES = [
     "For God so loved the world that he gave his one and only Son, that whoever believes in him shall not perish but have eternal life. - John 3:16",
@@ -70,27 +183,92 @@ EXCLUDE_ACTIONS = [
     app_commands.Choice(name="Clear (remove all excluded)", value="clear"),
 ]
 
-# Excluded users per guild for mute/unmute
-excluded_users = {}
-
 # --------- Bot Events ---------
 @bot.event
-async def on_ready():
-    logger.info(f'Logged in as {bot.user} ({bot.user.id})')
+async def setup_hook():
+    startup_profile.mark('login')
+    loop = asyncio.get_running_loop()
+    # Locate and probe FFmpeg once, off the event loop, before any playback;
+    # worker processes start meanwhile when AUDIO_WORKERS is set
+    workers_started = loop.run_in_executor(None, audio_workers.start) if audio_workers is not None else None
+    await loop.run_in_executor(None, get_ffmpeg_info)
+    # Load the shared music library in the background and watch it for changes
+    await library_service.start()
+    # Sample playback ffmpeg processes and enforce their resource limits
+    await ffmpeg_supervisor.start()
+    # Save where each song is playing, so a restart resumes close to it
+    await state_store.start()
+    # Track event-loop lag for /metrics
+    loop_lag_monitor.start()
+    if KEEP_ALIVE_ENABLED:
+        await health_server.start()
+    # Decode, encode and extract in worker processes when AUDIO_WORKERS is set
+    if workers_started is not None:
+        await workers_started
+        extractor.set_extract_func(audio_workers.extract)
+    startup_profile.mark('setup_hook')
+
+async def warm_up():
+    """Load what the first /music needs once logged in, so it doesn't delay readiness"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
     try:
-        synced = await bot.tree.sync()
-        logger.info(f'Successfully synced {len(synced)} application commands')
+        # With audio workers, yt-dlp and the gain stage run in the workers instead
+        if audio_workers is None:
+            await asyncio.gather(extractor.preload(), loop.run_in_executor(None, load_numpy))
+        logger.info(f'Warm-up finished in {loop.time() - started:.2f}s')
     except Exception as e:
-        logger.error(f'Failed to sync commands: {e}')
+        logger.warning(f'Warm-up failed: {e}')
+
+@bot.event
+async def on_ready():
+    logger.info(f'Logged in as {bot.user} ({bot.user.id}) with shards {sorted(bot.shards)} of {bot.shard_count}')
+    first_ready = startup_profile.ready()
+    if first_ready:
+        asyncio.create_task(warm_up())
+    # Commands are global; with several shard processes only the one owning shard 0 syncs
+    if bot.shard_ids is None or 0 in bot.shard_ids:
+        # Reconnects and restarts with unchanged commands skip the upload
+        try:
+            with startup_profile.measure('command_sync'):
+                await command_sync.sync(bot.tree, bot.application_id)
+        except Exception as e:
+            logger.error(f'Failed to sync commands: {e}')
+    if first_ready:
+        startup_profile.report()
+
+@bot.event
+async def on_shard_ready(shard_id):
+    logger.info(f'Shard {shard_id} ready')
 
 @bot.event
 async def on_guild_remove(guild):
     """Called when bot leaves a guild"""
     logger.info(f'Left guild: {guild.name} ({guild.id})')
     # Cleanup music player
+    idle_voice.cancel(guild.id)
     if guild.id in music_players:
         await music_players[guild.id].cleanup()
         del music_players[guild.id]
+    await state_store.unload(guild.id)
+
+@bot.event
+async def on_voice_state_update(member, before, after):
+    """Start the idle countdown when the bot is left alone or disconnected"""
+    guild = member.guild
+    if member.id == bot.user.id:
+        if after.channel is None:
+            # Disconnected from outside /leave; free the player after the timeout
+            idle_voice.schedule(guild.id, VOICE_TIMEOUT)
+        return
+
+    voice_client = guild.voice_client
+    if not voice_client or voice_client.channel not in (before.channel, after.channel):
+        return
+    if not has_listeners(voice_client.channel):
+        idle_voice.schedule(guild.id, VOICE_TIMEOUT)
+    elif guild.id in music_players and music_players[guild.id].is_active():
+        idle_voice.cancel(guild.id)
 
 # --------- Voice/Music Commands ---------
 @bot.tree.command(name="join", description="Join a voice channel (by name or mention)")
@@ -138,11 +316,13 @@ async def join(interaction: discord.Interaction, channel: str):
         try:
             voice_client = await voice_channel.connect(timeout=60.0, reconnect=True)
             logger.info(f'Connected to voice channel: {voice_channel.name} in guild: {interaction.guild.name}')
-            if interaction.guild.id not in music_players:
-                music_players[interaction.guild.id] = MusicPlayer(voice_client)
+            player = await get_music_player(interaction.guild, voice_client)
+            idle_voice.schedule(interaction.guild.id, VOICE_TIMEOUT)
+            restored = await restore_queue(interaction.guild.id, player)
+            if restored:
+                await interaction.followup.send(f"✅ Connected to {voice_channel.name} and resumed {restored} queued songs")
             else:
-                music_players[interaction.guild.id].voice_client = voice_client
-            await interaction.followup.send(f"✅ Connected to {voice_channel.name}")
+                await interaction.followup.send(f"✅ Connected to {voice_channel.name}")
         except asyncio.TimeoutError:
             await interaction.followup.send("❌ Connection timed out. This may be due to network restrictions in the hosting environment. The bot works best when self-hosted or on a VPS.")
             logger.error(f'Connection timeout for voice channel: {voice_channel.name}')
@@ -169,9 +349,11 @@ async def leave(interaction: discord.Interaction):
             await interaction.response.send_message("❌ Bot is not connected to a voice channel.", ephemeral=True)
             return
 
+        idle_voice.cancel(interaction.guild.id)
         if interaction.guild.id in music_players:
             await music_players[interaction.guild.id].cleanup()
             del music_players[interaction.guild.id]
+        await state_store.unload(interaction.guild.id)
 
         channel_name = interaction.guild.voice_client.channel.name
         await interaction.guild.voice_client.disconnect()
@@ -183,7 +365,7 @@ async def leave(interaction: discord.Interaction):
         await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
 
 @bot.tree.command(name="music", description="Play music from YouTube")
-@app_commands.describe(link="YouTube link or search term")
+@app_commands.describe(link="YouTube link, search term or local song name")
 async def music(interaction: discord.Interaction, link: str):
     """Play music from YouTube"""
     try:
@@ -197,10 +379,7 @@ async def music(interaction: discord.Interaction, link: str):
 
         await interaction.response.defer()
 
-        if interaction.guild.id not in music_players:
-            music_players[interaction.guild.id] = MusicPlayer(interaction.guild.voice_client)
-
-        player = music_players[interaction.guild.id]
+        player = await get_music_player(interaction.guild, interaction.guild.voice_client)
         result = await player.add_to_queue(link)
 
         if result['success']:
@@ -218,6 +397,52 @@ async def music(interaction: discord.Interaction, link: str):
         else:
             await interaction.followup.send(f"❌ An error occurred: {str(e)}")
 
+@music.autocomplete('link')
+async def music_autocomplete(interaction: discord.Interaction, current: str):
+    """Suggest local songs while typing /music"""
+    # Fuzzy matching on large libraries takes a few milliseconds; keep it off the loop
+    names = await asyncio.get_running_loop().run_in_executor(None, library_service.library.search, current, 25)
+    # Discord caps choices at 25 and names/values at 100 characters
+    return [app_commands.Choice(name=name, value=name) for name in names if len(name) <= 100]
+
+@bot.tree.command(name="playlist", description="Queue a whole YouTube playlist")
+@app_commands.describe(link="YouTube playlist link")
+async def playlist(interaction: discord.Interaction, link: str):
+    """Queue every song from a YouTube playlist"""
+    try:
+        if not is_admin(interaction.user):
+            await interaction.response.send_message("❌ You need administrator permissions to use this command.", ephemeral=True)
+            return
+
+        if not interaction.guild.voice_client:
+            await interaction.response.send_message("❌ Bot is not connected to a voice channel. Use `/join` first.", ephemeral=True)
+            return
+
+        await interaction.response.defer()
+
+        player = await get_music_player(interaction.guild, interaction.guild.voice_client)
+        status = await interaction.followup.send("📥 Importing playlist...", wait=True)
+
+        async def report_progress(count: int, title: str):
+            await status.edit(content=f"📥 Importing **{title}**... {count} songs queued so far")
+
+        result = await player.add_playlist(link, progress=report_progress)
+
+        if result['success']:
+            summary = f"📝 Added {result['added']} songs from **{result['title']}** to the queue"
+            if result['skipped']:
+                summary += f" ({result['skipped']} skipped)"
+            await status.edit(content=summary)
+        else:
+            await status.edit(content=f"❌ Error: {result['error']}")
+
+    except Exception as e:
+        logger.error(f'Error in playlist command: {e}')
+        if not interaction.response.is_done():
+            await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
+        else:
+            await interaction.followup.send(f"❌ An error occurred: {str(e)}")
+
 @bot.tree.command(name="skip", description="Skip the current song")
 async def skip(interaction: discord.Interaction):
     """Skip the current song"""
@@ -245,6 +470,76 @@ async def skip(interaction: discord.Interaction):
         logger.error(f'Error in skip command: {e}')
         await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
 
+@bot.tree.command(name="seek", description="Jump to a position in the current song")
+@app_commands.describe(position="Position as seconds, MM:SS or HH:MM:SS")
+async def seek(interaction: discord.Interaction, position: str):
+    """Jump to a position in the current song"""
+    try:
+        if not is_admin(interaction.user):
+            await interaction.response.send_message("❌ You need administrator permissions to use this command.", ephemeral=True)
+            return
+
+        if interaction.guild.id not in music_players:
+            await interaction.response.send_message("❌ No music player found.", ephemeral=True)
+            return
+
+        try:
+            seconds = parse_timestamp(position)
+        except ValueError:
+            await interaction.response.send_message("❌ Use seconds, MM:SS or HH:MM:SS (e.g. 1:30).", ephemeral=True)
+            return
+
+        await interaction.response.defer()
+        player = music_players[interaction.guild.id]
+        try:
+            seeked = await player.seek(seconds)
+        except ValueError:
+            await interaction.followup.send("❌ That position is outside the current song.")
+            return
+
+        if seeked:
+            await interaction.followup.send(f"⏩ Jumped to {format_duration(seconds)}")
+        else:
+            await interaction.followup.send("❌ No song is currently playing")
+
+    except Exception as e:
+        logger.error(f'Error in seek command: {e}')
+        if not interaction.response.is_done():
+            await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
+        else:
+            await interaction.followup.send(f"❌ An error occurred: {str(e)}")
+
+@bot.tree.command(name="volume", description="Set the music volume")
+@app_commands.describe(level="Volume in percent (0-200); leave empty to show the current volume")
+async def volume(interaction: discord.Interaction, level: app_commands.Range[int, 0, 200] = None):
+    """Show or set the music volume"""
+    try:
+        if interaction.guild.id not in music_players:
+            await interaction.response.send_message("❌ No music player found.", ephemeral=True)
+            return
+
+        player = music_players[interaction.guild.id]
+        if level is None:
+            await interaction.response.send_message(f"🔊 Volume is {round(player.gain.volume * 100)}%")
+            return
+
+        if not is_admin(interaction.user):
+            await interaction.response.send_message("❌ You need administrator permissions to use this command.", ephemeral=True)
+            return
+
+        state = await state_store.get(interaction.guild.id)
+        state.settings['volume'] = level / 100
+        state_store.mark_dirty(interaction.guild.id, SETTINGS)
+
+        if player.set_volume(level / 100):
+            await interaction.response.send_message(f"🔊 Volume set to {level}%")
+        else:
+            await interaction.response.send_message(f"🔊 Volume set to {level}% (takes effect from the next song)")
+
+    except Exception as e:
+        logger.error(f'Error in volume command: {e}')
+        await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
+
 @bot.tree.command(name="stop", description="Stop music and clear queue")
 async def stop(interaction: discord.Interaction):
     """Stop music and clear queue"""
@@ -270,23 +565,98 @@ async def stop(interaction: discord.Interaction):
         await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
 
 @bot.tree.command(name="queue", description="Show the current music queue")
-async def queue(interaction: discord.Interaction):
+@app_commands.describe(page="Page of the queue to show")
+async def queue(interaction: discord.Interaction, page: int = 1):
     """Show the current music queue"""
     try:
         if interaction.guild.id not in music_players:
             await interaction.response.send_message("❌ No music player found.", ephemeral=True)
             return
-        queue = music_players[interaction.guild.id].get_queue()
-        if not queue:
+        queue_page = music_players[interaction.guild.id].get_queue(page)
+        if not queue_page['current'] and not queue_page['total']:
             await interaction.response.send_message("🎵 The queue is empty.", ephemeral=True)
             return
-        description = "\n".join([f"{i+1}. {song['title']}" for i, song in enumerate(queue)])
-        embed = discord.Embed(title="Music Queue", description=description, color=0x3498db)
+        lines = []
+        if queue_page['current']:
+            current = queue_page['current']
+            elapsed = format_duration(int(music_players[interaction.guild.id].position))
+            total = f"/{format_duration(int(current['duration']))}" if current.get('duration') else ''
+            lines.append(f"**Now playing:** {current['title']} [{elapsed}{total}]\n")
+        lines.extend(f"{position}. {song['title']}" for position, song in queue_page['songs'])
+        embed = discord.Embed(title="Music Queue", description="\n".join(lines), color=0x3498db)
+        embed.set_footer(text=f"Page {queue_page['page']}/{queue_page['pages']} • {queue_page['total']} songs queued")
         await interaction.response.send_message(embed=embed)
     except Exception as e:
         logger.error(f'Error in queue command: {e}')
         await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
 
+@bot.tree.command(name="remove", description="Remove a song from the queue")
+@app_commands.describe(position="Queue position of the song to remove")
+async def remove(interaction: discord.Interaction, position: int):
+    """Remove a song from the queue"""
+    try:
+        if not is_admin(interaction.user):
+            await interaction.response.send_message("❌ You need administrator permissions to use this command.", ephemeral=True)
+            return
+
+        if interaction.guild.id not in music_players:
+            await interaction.response.send_message("❌ No music player found.", ephemeral=True)
+            return
+
+        try:
+            song = music_players[interaction.guild.id].remove(position)
+        except IndexError:
+            await interaction.response.send_message(f"❌ There is no song at position {position}.", ephemeral=True)
+            return
+        await interaction.response.send_message(f"🗑️ Removed from queue: **{song['title']}**")
+
+    except Exception as e:
+        logger.error(f'Error in remove command: {e}')
+        await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
+
+@bot.tree.command(name="move", description="Move a song to a different queue position")
+@app_commands.describe(source="Current queue position of the song", destination="New queue position")
+async def move(interaction: discord.Interaction, source: int, destination: int):
+    """Move a song within the queue"""
+    try:
+        if not is_admin(interaction.user):
+            await interaction.response.send_message("❌ You need administrator permissions to use this command.", ephemeral=True)
+            return
+
+        if interaction.guild.id not in music_players:
+            await interaction.response.send_message("❌ No music player found.", ephemeral=True)
+            return
+
+        try:
+            song = music_players[interaction.guild.id].move(source, destination)
+        except IndexError:
+            await interaction.response.send_message(f"❌ There is no song at position {source}.", ephemeral=True)
+            return
+        await interaction.response.send_message(f"↕️ Moved **{song['title']}** to position {destination}")
+
+    except Exception as e:
+        logger.error(f'Error in move command: {e}')
+        await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
+
+@bot.tree.command(name="shuffle", description="Shuffle the music queue")
+async def shuffle(interaction: discord.Interaction):
+    """Shuffle the upcoming songs"""
+    try:
+        if not is_admin(interaction.user):
+            await interaction.response.send_message("❌ You need administrator permissions to use this command.", ephemeral=True)
+            return
+
+        if interaction.guild.id not in music_players:
+            await interaction.response.send_message("❌ No music player found.", ephemeral=True)
+            return
+
+        music_players[interaction.guild.id].shuffle()
+        await interaction.response.send_message("🔀 Shuffled the queue")
+
+    except Exception as e:
+        logger.error(f'Error in shuffle command: {e}')
+        await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
+
 # --------- Fun Commands ---------
 @bot.tree.command(name="joke", description="Get a random joke")
 async def joke(interaction: discord.Interaction):
@@ -484,17 +854,19 @@ async def weather(interaction: discord.Interaction, city: str):
     """Get current weather information for a specified city"""
     try:
         await interaction.response.defer()
-        api_key = os.getenv("OPENWEATHER_API_KEY", None)
-        if not api_key:
+        if not WEATHER_API_KEY:
             await interaction.followup.send("❌ Weather API key not set.")
             return
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=metric"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    await interaction.followup.send("❌ Could not fetch weather info. Please check the city name.")
-                    return
-                data = await resp.json()
+        # Cached per city, so repeat lookups don't use API quota
+        try:
+            data = await weather_cache.get(city)
+        except (WeatherUnavailable, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Retries are used up; the details are for the log, not the channel
+            logger.warning(f'Weather lookup for {city} failed: {e}')
+            data = None
+        if data is None:
+            await interaction.followup.send("❌ Could not fetch weather info. Please check the city name.")
+            return
         desc = data["weather"][0]["description"].title()
         temp = data["main"]["temp"]
         feels = data["main"]["feels_like"]
@@ -657,10 +1029,9 @@ async def exclude(interaction: discord.Interaction, action: app_commands.Choice[
             await interaction.response.send_message("❌ You need administrator permissions to use this command.", ephemeral=True)
             return
 
+        # Excluded users per guild for mute/unmute, persisted in the state store
         guild_id = interaction.guild.id
-        if guild_id not in excluded_users:
-            excluded_users[guild_id] = set()
-        guild_excluded = excluded_users[guild_id]
+        guild_excluded = (await state_store.get(guild_id)).excluded
         action_val = action.value
 
         if action_val == "add":
@@ -671,6 +1042,7 @@ async def exclude(interaction: discord.Interaction, action: app_commands.Choice[
                 await interaction.response.send_message(f"❌ {user.display_name} is already excluded from mute/unmute commands.", ephemeral=True)
                 return
             guild_excluded.add(user.id)
+            state_store.mark_dirty(guild_id, EXCLUDED)
             embed = discord.Embed(
                 title="✅ User Added to Exclusion List",
                 description=f"{user.display_name} has been added to the exclusion list and will not be affected by mute/unmute commands.",
@@ -686,6 +1058,7 @@ async def exclude(interaction: discord.Interaction, action: app_commands.Choice[
                 await interaction.response.send_message(f"❌ {user.display_name} is not in the exclusion list.", ephemeral=True)
                 return
             guild_excluded.remove(user.id)
+            state_store.mark_dirty(guild_id, EXCLUDED)
             embed = discord.Embed(
                 title="✅ User Removed from Exclusion List",
                 description=f"{user.display_name} has been removed from the exclusion list and will now be affected by mute/unmute commands.",
@@ -719,6 +1092,7 @@ async def exclude(interaction: discord.Interaction, action: app_commands.Choice[
                 return
             excluded_count = len(guild_excluded)
             guild_excluded.clear()
+            state_store.mark_dirty(guild_id, EXCLUDED)
             embed = discord.Embed(
                 title="✅ Exclusion List Cleared",
                 description=f"All {excluded_count} users have been removed from the exclusion list.",
@@ -732,6 +1106,10 @@ async def exclude(interaction: discord.Interaction, action: app_commands.Choice[
     except Exception as e:
         logger.error(f'Error in exclude command: {e}')
         await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
+    finally:
+        # Guilds without a player would otherwise keep this state loaded forever
+        if interaction.guild:
+            await release_guild_state(interaction.guild.id)
 
 @bot.tree.command(name="help", description="Show available commands")
 async def help_command(interaction: discord.Interaction):
@@ -746,14 +1124,20 @@ async def help_command(interaction: discord.Interaction):
             "`/join <channel>` - Join a voice channel",
             "`/leave` - Leave the current voice channel",
             "`/music <link>` - Play music from YouTube",
+            "`/playlist <link>` - Queue a whole YouTube playlist",
             "`/skip` - Skip the current song",
             "`/stop` - Stop music and clear queue",
+            "`/remove <position>` - Remove a song from the queue",
+            "`/move <source> <destination>` - Move a song within the queue",
+            "`/shuffle` - Shuffle the queue",
+            "`/seek <position>` - Jump to a position in the current song",
+            "`/volume <percent>` - Set the music volume",
             "`/mute` - Server mute all users in bot's voice channel",
             "`/unmute` - Server unmute all users in bot's voice channel",
             "`/exclude <action> [user]` - Manage excluded users (add/remove/list/clear)"
         ]
         general_commands = [
-            "`/queue` - Show the current music queue",
+            "`/queue [page]` - Show the current music queue",
             "`/truth` - Get an encouraging Bible verse",
             "`/help` - Show this help message"
         ]
@@ -787,6 +1171,23 @@ async def help_command(interaction: discord.Interaction):
         logger.error(f'Error in help command: {e}')
         await interaction.response.send_message(f"❌ An error occurred: {str(e)}", ephemeral=True)
 
+@bot.tree.command(name="synccommands", description="Upload the bot's slash commands to Discord (bot owner only)")
+async def synccommands(interaction: discord.Interaction):
+    """Force a global command sync even if the schema hash is unchanged"""
+    try:
+        if not await bot.is_owner(interaction.user):
+            await interaction.response.send_message("❌ Only the bot owner can use this command.", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        synced = await command_sync.sync(bot.tree, bot.application_id, force=True)
+        await interaction.followup.send(f"✅ Synced {len(synced)} application commands", ephemeral=True)
+        logger.info(f'Command sync forced by {interaction.user.name}')
+
+    except Exception as e:
+        logger.error(f'Error in synccommands command: {e}')
+        await interaction.followup.send(f"❌ An error occurred: {str(e)}", ephemeral=True)
+
 # --------- Error Handling ---------
 @bot.tree.error
 async def on_app_command_error(interaction: discord.Interaction, error: Exception):
@@ -798,5 +1199,35 @@ async def on_app_command_error(interaction: discord.Interaction, error: Exceptio
         await interaction.followup.send(f"❌ An error occurred: {str(error)}")
 
 # --------- Bot Run ---------
+async def main():
+    startup_profile.mark('imports')
+    # Railway (like Docker) stops containers with SIGTERM; close the bot so the
+    # cleanup below still runs and the pending state is written
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(bot.close()))
+    except (NotImplementedError, AttributeError):
+        pass  # No signal handlers on Windows event loops
+    async with bot:
+        try:
+            await bot.start(BOT_TOKEN)
+        finally:
+            # Write pending state before the process exits
+            await state_store.close()
+            loudness_analyzer.shutdown()
+            await asyncio.get_running_loop().run_in_executor(None, metadata_store.close)
+            await ffmpeg_supervisor.stop()
+            await library_service.stop()
+            await health_server.stop()
+            loop_lag_monitor.stop()
+            await http_client.close()
+            if audio_workers is not None:
+                await asyncio.get_running_loop().run_in_executor(None, audio_workers.stop)
+
 if __name__ == "__main__":
-    bot.run(BOT_TOKEN)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Write out records still queued for the log writer thread
+        shutdown_logging()
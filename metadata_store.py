@@ -0,0 +1,230 @@
+"""
+Persistent on-disk cache of track metadata from yt-dlp lookups
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+from config import METADATA_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+_VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    video_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    duration INTEGER NOT NULL DEFAULT 0,
+    uploader TEXT,
+    webpage_url TEXT NOT NULL,
+    formats TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queries (
+    query TEXT PRIMARY KEY,
+    video_id TEXT NOT NULL REFERENCES tracks(video_id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS loudness (
+    track_key TEXT PRIMARY KEY,
+    integrated_lufs REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def video_id_from_url(url: str) -> Optional[str]:
+    """Get the YouTube video id from a watch, youtu.be or shorts URL"""
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or '').lower()
+    candidate = None
+    if host.endswith('youtu.be'):
+        candidate = parsed.path.lstrip('/').split('/')[0]
+    elif host.endswith('youtube.com'):
+        if parsed.path == '/watch':
+            candidate = parse_qs(parsed.query).get('v', [None])[0]
+        elif parsed.path.startswith(('/shorts/', '/embed/', '/live/')):
+            candidate = parsed.path.split('/')[2]
+    if candidate and _VIDEO_ID_RE.match(candidate):
+        return candidate
+    return None
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a /music argument so equivalent requests share one cache key"""
+    video_id = video_id_from_url(query)
+    if video_id:
+        return video_id
+    return ' '.join(query.lower().split())
+
+
+def track_key(song: Dict[str, Any]) -> Optional[str]:
+    """Get a stable key for a queued song; local keys change when the file does"""
+    if song.get('is_local'):
+        try:
+            stat = os.stat(song['url'])
+        except OSError:
+            return None
+        return f"local:{os.path.abspath(song['url'])}:{stat.st_mtime}:{stat.st_size}"
+    if song.get('id'):
+        return f"yt:{song['id']}"
+    return None
+
+
+def _compact_formats(formats: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Keep only the audio-relevant fields of yt-dlp's format list"""
+    compact = []
+    for fmt in formats or []:
+        if fmt.get('acodec') in (None, 'none'):
+            continue
+        compact.append({
+            'format_id': fmt.get('format_id'),
+            'ext': fmt.get('ext'),
+            'acodec': fmt.get('acodec'),
+            'abr': fmt.get('abr'),
+            'asr': fmt.get('asr'),
+        })
+    return compact
+
+
+class MetadataStore:
+    """SQLite-backed track metadata that survives restarts.
+
+    All database access happens on one dedicated thread, so callers on the
+    event loop never block on disk I/O.
+    """
+
+    def __init__(self, path: str = METADATA_DB_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='metadata-store')
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA foreign_keys=ON')
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        key = normalize_query(query)
+        # Two primary-key lookups; an OR across the join would scan both tables
+        row = conn.execute('SELECT * FROM tracks WHERE video_id = ?', (key,)).fetchone()
+        if row is None:
+            row = conn.execute(
+                'SELECT t.* FROM queries q JOIN tracks t ON t.video_id = q.video_id WHERE q.query = ?',
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row['video_id'],
+            'title': row['title'],
+            'duration': row['duration'],
+            'uploader': row['uploader'],
+            'webpage_url': row['webpage_url'],
+            'formats': json.loads(row['formats'] or '[]'),
+        }
+
+    def _save(self, info: Dict[str, Any], query: Optional[str]):
+        video_id = info.get('id')
+        webpage_url = info.get('webpage_url')
+        if not video_id or not webpage_url:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO tracks '
+                '(video_id, title, duration, uploader, webpage_url, formats, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    video_id,
+                    info.get('title', 'Unknown Title'),
+                    int(info.get('duration') or 0),
+                    info.get('uploader', 'Unknown'),
+                    webpage_url,
+                    json.dumps(_compact_formats(info.get('formats')), separators=(',', ':')),
+                    time.time(),
+                )
+            )
+            if query:
+                key = normalize_query(query)
+                if key != video_id:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO queries (query, video_id) VALUES (?, ?)',
+                        (key, video_id)
+                    )
+
+    def _get_loudness(self, key: str) -> Optional[float]:
+        row = self._connect().execute(
+            'SELECT integrated_lufs FROM loudness WHERE track_key = ?', (key,)
+        ).fetchone()
+        return row['integrated_lufs'] if row else None
+
+    def _save_loudness(self, key: str, lufs: float):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO loudness (track_key, integrated_lufs, updated_at) VALUES (?, ?, ?)',
+                (key, lufs, time.time())
+            )
+
+    async def get_loudness(self, key: str) -> Optional[float]:
+        """Get the stored integrated loudness (LUFS) for a track key"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self._get_loudness, key)
+        except sqlite3.Error as e:
+            logger.error(f'Loudness lookup failed: {e}')
+            return None
+
+    async def save_loudness(self, key: str, lufs: float):
+        """Store the integrated loudness (LUFS) measured for a track key"""
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._save_loudness, key, lufs)
+        except sqlite3.Error as e:
+            logger.error(f'Loudness save failed: {e}')
+
+    async def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Get stored metadata for a video id, YouTube URL or search term"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self._lookup, query)
+        except sqlite3.Error as e:
+            logger.error(f'Metadata lookup failed: {e}')
+            return None
+
+    async def save(self, info: Dict[str, Any], query: Optional[str] = None):
+        """Store metadata from a yt-dlp info dict, optionally under the query that found it"""
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._save, info, query)
+        except sqlite3.Error as e:
+            logger.error(f'Metadata save failed: {e}')
+
+    def close(self):
+        """Close the database connection"""
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close).result()
+        self._executor.shutdown(wait=True)
+
+
+# Shared by every guild's MusicPlayer
+metadata_store = MetadataStore()
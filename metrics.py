@@ -0,0 +1,272 @@
+"""
+In-process metrics rendered in the Prometheus text format
+"""
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import discord
+from discord import app_commands
+
+from log_pipeline import log_context
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers a cached command reply up to a slow yt-dlp lookup
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Tuple[str, ...]) -> Tuple[str, ...]:
+        # Label values are turned into strings when rendered, not per observation
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}')
+        return labels
+
+    def samples(self) -> Iterable[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name + '_total', dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    """Counts of observations per bucket, with their sum"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [count per bucket (+Inf last), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, *labels: str) -> '_Timer':
+        """Context manager observing the time its block takes"""
+        return _Timer(self, labels)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield self.name + '_bucket', dict(labels, le=le), cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Sequence[str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Gauge(_Metric):
+    """Current values, read from a callback at scrape time.
+
+    The callback returns a number, or (labels, value) pairs for a labelled
+    gauge, so nothing is tracked between scrapes.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], object]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = value
+
+    def set_function(self, function: Callable[[], object]):
+        self.function = function
+
+    def samples(self) -> Iterable[Sample]:
+        if self.function is None:
+            yield self.name, {}, self._value
+            return
+        result = self.function()
+        if isinstance(result, (int, float)):
+            yield self.name, {}, float(result)
+            return
+        for labels, value in result:
+            yield self.name, dict(zip(self.labelnames, self._key(labels))), float(value)
+
+
+class Registry:
+    """Set of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def render(self) -> str:
+        """Get every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error(f'Collecting metric {metric.name} failed: {e}')
+                continue
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by the whole bot
+registry = Registry()
+
+COMMAND_LATENCY = registry.histogram(
+    'discord_command_duration_seconds', 'Time to handle a slash command', ['command', 'status'])
+EXTRACTION_TIME = registry.histogram(
+    'ytdlp_extraction_duration_seconds', 'Time for a yt-dlp lookup, including the wait for a worker', ['outcome'])
+FFMPEG_SPAWN_TIME = registry.histogram(
+    'ffmpeg_spawn_duration_seconds', 'Time to start a playback ffmpeg process', buckets=LAG_BUCKETS)
+LOOP_LAG = registry.histogram(
+    'event_loop_lag_seconds', 'How late the event loop runs a scheduled wakeup', buckets=LAG_BUCKETS)
+INTERTRACK_GAP = registry.histogram(
+    'music_intertrack_gap_seconds', 'Silence between one song ending and the next starting')
+
+
+class TimedCommandTree(app_commands.CommandTree):
+    """Command tree that records how long each slash command takes.
+
+    Log lines written while a command runs carry its guild, command and user
+    (see log_pipeline.log_context).
+    """
+
+    async def _call(self, interaction: discord.Interaction) -> None:
+        if interaction.type is not discord.InteractionType.application_command:
+            return await super()._call(interaction)
+        log_context.set({
+            'guild_id': interaction.guild_id,
+            'command': interaction.data.get('name') if interaction.data else None,
+            'user_id': interaction.user.id,
+        })
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            await super()._call(interaction)
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            if interaction.command_failed:
+                status = 'error'
+            name = interaction.command.qualified_name if interaction.command else 'unknown'
+            COMMAND_LATENCY.observe(time.perf_counter() - started, name, status)
+
+
+class LoopLagMonitor:
+    """Measures event-loop lag by how late a periodic sleep wakes up"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - before - self.interval)
+            LOOP_LAG.observe(self.last)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+loop_lag_monitor = LoopLagMonitor()
+registry.gauge('event_loop_lag_last_seconds', 'Most recent event-loop lag sample', function=lambda: loop_lag_monitor.last)
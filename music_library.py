@@ -1,57 +1,255 @@
 """
 Music library management for local audio files
 """
+import bisect
+import difflib
+import json
+import logging
 import os
 import random
-from typing import List, Dict, Optional
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import LIBRARY_INDEX_PATH
+
+try:
+    import mutagen
+except ImportError:  # Tags and durations are optional
+    mutagen = None
+
+logger = logging.getLogger(__name__)
+
+# Sorted search keys on each side of the query compared for fuzzy matches
+FUZZY_WINDOW = 500
+
+
+def _normalize(text: str) -> str:
+    """Lowercase and collapse whitespace/punctuation for matching"""
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in text.lower()).split())
+
+
+def _read_tags(path: str) -> Dict[str, Any]:
+    """Read title/artist/album tags and duration from an audio file"""
+    if mutagen is None:
+        return {}
+    try:
+        audio = mutagen.File(path, easy=True)
+    except Exception as e:
+        logger.debug(f'Could not read tags from {path}: {e}')
+        return {}
+    if audio is None:
+        return {}
+
+    def first(key):
+        values = audio.get(key) if audio.tags is not None else None
+        return values[0] if values else None
+
+    return {
+        'title': first('title'),
+        'artist': first('artist'),
+        'album': first('album'),
+        'duration': int(getattr(audio.info, 'length', 0) or 0),
+    }
+
 
 class MusicLibrary:
-    """Manages local music files and provides selection interface"""
+    """Manages local music files and provides selection interface.
+
+    Songs are keyed by their path relative to the music directory, without
+    extension (e.g. "Amazing Grace" or "Hymns/Amazing Grace"). The index is
+    persisted to disk and rescans only re-read files whose mtime or size
+    changed.
+    """
     
-    def __init__(self, music_directory: str = "music"):
+    def __init__(self, music_directory: str = "music", index_path: str = LIBRARY_INDEX_PATH, scan: bool = True):
         self.music_directory = music_directory
+        self.index_path = index_path
         self.supported_formats = ['.mp3', '.wav', '.m4a', '.ogg', '.flac']
-        self.music_files = self._scan_music_files()
+        # (tracks, search keys), replaced as a whole so readers on other
+        # threads always see a consistent pair
+        self._index: Tuple[Dict[str, Dict[str, Any]], List[Tuple[str, str]]] = ({}, [])
+        self._load_index()
+        if scan:
+            self.refresh_library()
+    
+    @property
+    def tracks(self) -> Dict[str, Dict[str, Any]]:
+        """Song name to indexed metadata mapping"""
+        return self._index[0]
+    
+    @property
+    def music_files(self) -> Dict[str, str]:
+        """Song name to file path mapping"""
+        return {name: track['path'] for name, track in self.tracks.items()}
         
-    def _scan_music_files(self) -> Dict[str, str]:
-        """Scan music directory for supported audio files"""
-        music_files = {}
+    def _scan_music_files(self) -> Dict[str, Dict[str, Any]]:
+        """Recursively scan the music directory, reusing index entries for unchanged files"""
+        tracks = {}
         
         if not os.path.exists(self.music_directory):
             os.makedirs(self.music_directory)
-            return music_files
+            return tracks
+        
+        pending = [self.music_directory]
+        while pending:
+            directory = pending.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError as e:
+                logger.warning(f'Could not scan {directory}: {e}')
+                continue
             
-        for filename in os.listdir(self.music_directory):
-            if any(filename.lower().endswith(ext) for ext in self.supported_formats):
-                # Use filename without extension as display name
-                display_name = os.path.splitext(filename)[0]
-                file_path = os.path.join(self.music_directory, filename)
-                music_files[display_name] = file_path
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                    continue
+                if not any(entry.name.lower().endswith(ext) for ext in self.supported_formats):
+                    continue
                 
-        return music_files
+                # Use the relative path without extension as display name
+                relative = os.path.relpath(entry.path, self.music_directory)
+                display_name = os.path.splitext(relative)[0].replace(os.sep, '/')
+                stat = entry.stat()
+                
+                known = self.tracks.get(display_name)
+                if known and known['mtime'] == stat.st_mtime and known['size'] == stat.st_size:
+                    tracks[display_name] = known
+                    continue
+                
+                track = {
+                    'path': entry.path,
+                    'mtime': stat.st_mtime,
+                    'size': stat.st_size,
+                    'title': None,
+                    'artist': None,
+                    'album': None,
+                    'duration': 0,
+                }
+                track.update(_read_tags(entry.path))
+                tracks[display_name] = track
+                
+        return tracks
+    
+    def _build_search_keys(self, tracks: Dict[str, Dict[str, Any]]) -> List[Tuple[str, str]]:
+        """Build a sorted (normalized text, song name) list for prefix search"""
+        keys = []
+        for name, track in tracks.items():
+            texts = {name, os.path.basename(name)}
+            if track.get('title'):
+                texts.add(track['title'])
+                if track.get('artist'):
+                    texts.add(f"{track['artist']} {track['title']}")
+            for text in texts:
+                normalized = _normalize(text)
+                keys.append((normalized, name))
+                # Also index every word so "grace" finds "Amazing Grace"
+                words = normalized.split(' ')
+                for i in range(1, len(words)):
+                    keys.append((' '.join(words[i:]), name))
+        keys.sort()
+        return keys
+    
+    def _load_index(self):
+        """Load the persisted index, if any"""
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('music_directory') == os.path.abspath(self.music_directory):
+            tracks = data.get('tracks', {})
+            self._index = (tracks, self._build_search_keys(tracks))
+    
+    def _save_index(self):
+        """Persist the index atomically"""
+        data = {'music_directory': os.path.abspath(self.music_directory), 'tracks': self.tracks}
+        try:
+            os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+            temp_path = f'{self.index_path}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            logger.warning(f'Could not save music library index: {e}')
     
     def get_music_list(self) -> List[str]:
         """Get list of available music files"""
-        return list(self.music_files.keys())
+        return list(self.tracks.keys())
     
     def get_file_path(self, song_name: str) -> Optional[str]:
         """Get file path for a song name"""
-        return self.music_files.get(song_name)
+        track = self.tracks.get(song_name)
+        return track['path'] if track else None
+    
+    def get_track(self, song_name: str) -> Optional[Dict[str, Any]]:
+        """Get the indexed metadata (path, title, artist, album, duration) for a song"""
+        return self.tracks.get(song_name)
+    
+    def search(self, query: str, limit: int = 25) -> List[str]:
+        """Find songs by name/tag prefix, falling back to substring and fuzzy matches"""
+        needle = _normalize(query)
+        if not needle:
+            return list(islice(self.tracks, limit))
+        
+        keys = self._index[1]
+        results: List[str] = []
+        seen = set()
+        
+        def add(name):
+            if name not in seen:
+                seen.add(name)
+                results.append(name)
+        
+        # Prefix matches on whole names and on each word
+        index = bisect.bisect_left(keys, (needle, ''))
+        while index < len(keys) and keys[index][0].startswith(needle) and len(results) < limit:
+            add(keys[index][1])
+            index += 1
+        
+        # Substring matches anywhere in the name
+        if len(results) < limit:
+            for text, name in keys:
+                if needle in text:
+                    add(name)
+                    if len(results) >= limit:
+                        break
+        
+        # Typo-tolerant matches. Only texts that sort near the query are
+        # compared, which keeps this bounded for large libraries.
+        if len(results) < limit:
+            position = bisect.bisect_left(keys, (needle, ''))
+            window = keys[max(0, position - FUZZY_WINDOW):position + FUZZY_WINDOW]
+            texts = {}
+            for text, name in window:
+                texts.setdefault(text, name)
+            for text in difflib.get_close_matches(needle, list(texts), n=limit, cutoff=0.6):
+                add(texts[text])
+                if len(results) >= limit:
+                    break
+        
+        return results
     
     def get_random_song(self) -> Optional[Dict[str, str]]:
         """Get a random song from the library"""
-        if not self.music_files:
+        tracks = self.tracks
+        if not tracks:
             return None
             
-        song_name = random.choice(list(self.music_files.keys()))
+        song_name = random.choice(list(tracks.keys()))
         return {
             'name': song_name,
-            'path': self.music_files[song_name]
+            'path': tracks[song_name]['path']
         }
     
     def refresh_library(self):
-        """Refresh the music library (rescan files)"""
-        self.music_files = self._scan_music_files()
+        """Refresh the music library (rescan changed files)"""
+        tracks = self._scan_music_files()
+        if tracks == self.tracks:
+            return
+        self._index = (tracks, self._build_search_keys(tracks))
+        self._save_index()
     
     def add_default_songs(self):
         """Add some default Christian/worship songs information"""
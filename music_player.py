@@ -1,66 +1,67 @@
 import discord
 import asyncio
-import yt_dlp
 import logging
 import os
-import shutil
-from typing import Dict, List, Optional, Any
-from config import FFMPEG_OPTIONS, YDL_OPTIONS
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from config import FFMPEG_OPTIONS, DEFAULT_VOLUME, MAX_VOLUME, STREAM_FAILURE_WINDOW, PREFETCH_WARM_FFMPEG, PREFETCH_WARM_LEAD, QUEUE_PAGE_SIZE, LOUDNESS_NORMALIZATION, RESUME_MAX_ATTEMPTS, RESUME_END_MARGIN, RESUME_RECONNECT_TIMEOUT
 from music_library import MusicLibrary
+from library_service import library_service
+from song_queue import SongQueue, QueueFullError
+from ffmpeg_locator import find_ffmpeg
+from extractor import AsyncExtractor, ExtractionError, ExtractionTimeout, extractor as default_extractor
+from stream_cache import StreamCache, stream_cache as default_stream_cache
+from metadata_store import MetadataStore, metadata_store as default_metadata_store
+from audio_gain import GainControl, GainTransformer
+from audio_position import PositionTrackingSource
+from ffmpeg_supervisor import FFmpegSupervisor, SupervisedOpusAudio, SupervisedPCMAudio, ffmpeg_supervisor as default_ffmpeg_supervisor
+from audio_worker import AudioWorkers, RemoteAudioSource, audio_workers as default_audio_workers
+from opus_cache import OpusCache, opus_cache as default_opus_cache
+from metrics import INTERTRACK_GAP
+from loudness import LoudnessAnalyzer, gain_for_loudness, loudness_analyzer as default_loudness_analyzer
 
 logger = logging.getLogger(__name__)
 
-def find_ffmpeg():
-    """Find FFmpeg executable on the system"""
-    # Check manual installation in ffmpeg-bin folder (for GitHub upload)
-    manual_paths = [
-        './ffmpeg-bin/ffmpeg.exe',  # Windows
-        './ffmpeg-bin/ffmpeg',      # Linux
-        './bin/ffmpeg'              # Local installation
-    ]
-    
-    for path in manual_paths:
-        if os.path.exists(path):
-            return path
-    
-    # Try shutil.which first (checks PATH)
-    ffmpeg_path = shutil.which('ffmpeg')
-    if ffmpeg_path:
-        return ffmpeg_path
-    
-    # Try common system locations
-    system_paths = [
-        '/usr/bin/ffmpeg',           # Standard Linux
-        '/usr/local/bin/ffmpeg',     # Manual install
-        '/bin/ffmpeg',               # Some distros
-        '/opt/ffmpeg/bin/ffmpeg',    # Custom install
-    ]
-    
-    for path in system_paths:
-        if os.path.exists(path):
-            return path
-    
-    # Try to find in /nix/store (for Replit/NixOS)
-    if os.path.exists('/nix/store'):
-        for root, dirs, files in os.walk('/nix/store'):
-            if 'ffmpeg' in files and 'bin' in root:
-                candidate = os.path.join(root, 'ffmpeg')
-                if os.path.exists(candidate):
-                    return candidate
-    
-    # Default fallback
-    return 'ffmpeg'
-
 class MusicPlayer:
     """Handles music playback for a Discord voice client"""
     
-    def __init__(self, voice_client: discord.VoiceClient):
+    def __init__(self, voice_client: discord.VoiceClient, extractor: Optional[AsyncExtractor] = None,
+                 stream_cache: Optional[StreamCache] = None, metadata_store: Optional[MetadataStore] = None,
+                 music_library: Optional[MusicLibrary] = None, opus_cache: Optional[OpusCache] = None,
+                 loudness_analyzer: Optional[LoudnessAnalyzer] = None,
+                 ffmpeg_supervisor: Optional[FFmpegSupervisor] = None,
+                 audio_workers: Optional[AudioWorkers] = None):
         self.voice_client = voice_client
-        self.queue: List[Dict[str, Any]] = []
+        self.extractor = extractor or default_extractor
+        self.stream_cache = stream_cache or default_stream_cache
+        self.metadata_store = metadata_store or default_metadata_store
+        self.opus_cache = opus_cache or default_opus_cache
+        self.loudness = loudness_analyzer or default_loudness_analyzer
+        self.ffmpeg_supervisor = ffmpeg_supervisor or default_ffmpeg_supervisor
+        self.audio_workers = audio_workers or default_audio_workers
+        self.gain = GainControl(DEFAULT_VOLUME)
+        self.queue = SongQueue()
         self.current_song: Optional[Dict[str, Any]] = None
         self.is_playing_flag = False
         self.skip_flag = False
-        self.music_library = MusicLibrary()
+        self.music_library = music_library or library_service.library
+        # Set when the current song plays from a cached stream URL, so a
+        # failed open can be retried with a fresh extraction
+        self.stream_from_cache = False
+        self.started_at = 0.0
+        # Frame-counting wrapper around the playing source, for seek and resume
+        self.position_source: Optional[PositionTrackingSource] = None
+        self.resume_task: Optional[asyncio.Task] = None
+        # Called when the queue runs out, e.g. to start an idle-disconnect countdown
+        self.on_idle: Optional[Callable[[], None]] = None
+        # Called when the queue or current song changes, e.g. to persist a snapshot
+        self.on_queue_change: Optional[Callable[[], None]] = None
+        # Prefetch of the next queued song and inter-track gap tracking
+        self.prefetched: Optional[Tuple[Dict[str, Any], asyncio.Future]] = None
+        self.prefetch_task: Optional[asyncio.Task] = None
+        # (song, source, stream URL, from stream cache, start offset)
+        self.warm_source: Optional[Tuple[Dict[str, Any], PositionTrackingSource, str, bool, float]] = None
+        self.ended_at: Optional[float] = None
         
     async def add_to_queue(self, input_str: str) -> Dict[str, Any]:
         """Add a song to the queue (local file name or YouTube URL)"""
@@ -79,35 +80,45 @@ class MusicPlayer:
     
     async def _add_local_file(self, song_name: str, file_path: str) -> Dict[str, Any]:
         """Add a local file to the queue"""
+        track = self.music_library.get_track(song_name) or {}
         song_info = {
-            'title': song_name,
+            'title': track.get('title') or song_name,
             'url': file_path,
             'webpage_url': file_path,
-            'duration': 0,  # Could be calculated with mutagen library
-            'uploader': 'Local Library',
+            'duration': track.get('duration') or 0,
+            'uploader': track.get('artist') or 'Local Library',
             'is_local': True
         }
         
-        # Clear queue and add only this song for single playback
-        self.queue.clear()
-        self.queue.append(song_info)
+        return await self._enqueue(song_info)
+    
+    async def _enqueue(self, song_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a song and start playback if nothing is playing"""
+        try:
+            position = self.queue.add(song_info)
+        except QueueFullError as e:
+            return {'success': False, 'error': str(e)}
+        self._queue_changed()
         
         # If nothing is playing, start playing
-        if not self.is_playing_flag:
+        if self._idle():
             await self._play_next()
             return {'success': True, 'title': song_info['title'], 'position': 0}
-        else:
-            # Stop current and play new
-            self.skip_flag = True
-            self.voice_client.stop()
-            return {'success': True, 'title': song_info['title'], 'position': 0}
+        
+        # The new song is up next, so start resolving it now
+        if position == 0:
+            self._schedule_prefetch()
+        return {'success': True, 'title': song_info['title'], 'position': position + 1}
     
     async def _add_youtube_url(self, url: str) -> Dict[str, Any]:
         """Add a YouTube URL to the queue"""
-        # Extract video info
-        with yt_dlp.YoutubeDL(YDL_OPTIONS) as ydl:
-            try:
-                info = ydl.extract_info(url, download=False)
+        try:
+            # Repeat requests are answered from the on-disk metadata cache; the
+            # short-lived stream URL is resolved when the song starts playing
+            info = await self.metadata_store.lookup(url)
+            if info is None:
+                # Extract video info
+                info = await self.extractor.extract(url)
                 
                 # Handle playlists
                 if 'entries' in info:
@@ -117,133 +128,528 @@ class MusicPlayer:
                     else:
                         return {'success': False, 'error': 'Empty playlist'}
                 
-                # Check duration - limit to 10 minutes for testing
-                duration = info.get('duration', 0)
-                if duration > 600:  # 10 minutes
-                    return {'success': False, 'error': 'Song too long (max 10 minutes for testing)'}
-                
-                # Extract required information
-                song_info = {
-                    'title': info.get('title', 'Unknown Title'),
-                    'url': info.get('url', ''),
-                    'webpage_url': info.get('webpage_url', url),
-                    'duration': duration,
-                    'uploader': info.get('uploader', 'Unknown'),
-                    'is_local': False
-                }
+                # Keep the resolved stream so playback doesn't extract again
+                self.stream_cache.put(info.get('id'), info)
+                await self.metadata_store.save(info, query=url)
+            
+            # Check duration - limit to 10 minutes for testing
+            duration = info.get('duration') or 0
+            if duration > 600:  # 10 minutes
+                return {'success': False, 'error': 'Song too long (max 10 minutes for testing)'}
+            
+            # Extract required information
+            song_info = {
+                'id': info.get('id'),
+                'title': info.get('title', 'Unknown Title'),
+                'url': info.get('url', ''),
+                'webpage_url': info.get('webpage_url', url),
+                'duration': duration,
+                'uploader': info.get('uploader', 'Unknown'),
+                'is_local': False
+            }
+            
+            return await self._enqueue(song_info)
+            
+        except ExtractionTimeout:
+            return {'success': False, 'error': 'YouTube took too long to respond. Please try again.'}
+        except ExtractionError as e:
+            error_msg = str(e)
+            if "Sign in to confirm" in error_msg:
+                return {'success': False, 'error': 'YouTube blocked this request. Try a different video or use a direct link.'}
+            elif "Video unavailable" in error_msg:
+                return {'success': False, 'error': 'Video is unavailable or private'}
+            elif "blocked" in error_msg.lower():
+                return {'success': False, 'error': 'Video is blocked in your region'}
+            else:
+                return {'success': False, 'error': f'YouTube access issue: Try a different video'}
+    
+    async def add_playlist(self, url: str,
+                           progress: Optional[Callable[[int, str], Awaitable[None]]] = None) -> Dict[str, Any]:
+        """Queue every entry of a playlist without resolving the individual videos.
+
+        Entries are queued in batches as the playlist pages arrive; each one's
+        stream is only resolved when it reaches the head of the queue. The
+        optional progress coroutine is awaited after each batch with the number
+        of songs queued so far and the playlist title.
+        """
+        added = skipped = 0
+        title = 'Unknown Playlist'
+        try:
+            async for title, entries in self.extractor.iter_playlist(url):
+                songs = []
+                for entry in entries:
+                    song = self._song_from_flat_entry(entry)
+                    if song is None:
+                        skipped += 1
+                    else:
+                        songs.append(song)
                 
-                # Clear queue and add only this song for single playback
-                self.queue.clear()
-                self.queue.append(song_info)
+                head = self.queue.peek()
+                batch_added = self.queue.add_many(songs)
+                self._queue_changed()
+                added += batch_added
                 
-                # If nothing is playing, start playing
-                if not self.is_playing_flag:
+                if self._idle() and self.queue:
                     await self._play_next()
-                    return {'success': True, 'title': song_info['title'], 'position': 0}
                 else:
-                    # Stop current and play new
-                    self.skip_flag = True
-                    self.voice_client.stop()
-                    return {'success': True, 'title': song_info['title'], 'position': 0}
+                    self._head_changed(head)
                 
-            except yt_dlp.utils.DownloadError as e:
-                error_msg = str(e)
-                if "Sign in to confirm" in error_msg:
-                    return {'success': False, 'error': 'YouTube blocked this request. Try a different video or use a direct link.'}
-                elif "Video unavailable" in error_msg:
-                    return {'success': False, 'error': 'Video is unavailable or private'}
-                elif "blocked" in error_msg.lower():
-                    return {'success': False, 'error': 'Video is blocked in your region'}
-                else:
-                    return {'success': False, 'error': f'YouTube access issue: Try a different video'}
+                if progress:
+                    await progress(added, title)
+                if batch_added < len(songs):
+                    # Queue is full; stop fetching further pages
+                    skipped += len(songs) - batch_added
+                    break
+        except ExtractionTimeout:
+            if not added:
+                return {'success': False, 'error': 'YouTube took too long to respond. Please try again.'}
+        except ExtractionError as e:
+            logger.error(f'Error importing playlist: {e}')
+            if not added:
+                return {'success': False, 'error': 'Could not read this playlist. Is it public?'}
+        
+        if not added:
+            return {'success': False, 'error': 'No playable songs found in this playlist'}
+        return {'success': True, 'title': title, 'added': added, 'skipped': skipped}
+    
+    def _song_from_flat_entry(self, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Build a lightweight queue entry from a flat playlist entry"""
+        video_id = entry.get('id')
+        duration = entry.get('duration') or 0
+        if not video_id or duration > 600:  # 10 minutes
+            return None
+        
+        if entry.get('ie_key', 'Youtube') == 'Youtube':
+            webpage_url = f'https://www.youtube.com/watch?v={video_id}'
+        else:
+            webpage_url = entry.get('webpage_url') or entry.get('url')
+        
+        return {
+            'id': video_id,
+            'title': entry.get('title') or 'Unknown Title',
+            'webpage_url': webpage_url,
+            'duration': duration,
+            'uploader': entry.get('uploader') or entry.get('channel') or 'Unknown',
+            'is_local': False
+        }
     
     async def _play_next(self):
-        """Play the next song in the queue"""
+        """Play the next song in the queue, skipping songs that fail to start"""
         try:
-            if not self.queue:
-                self.is_playing_flag = False
-                self.current_song = None
-                return
-            
-            # Get next song
-            self.current_song = self.queue.pop(0)
-            self.is_playing_flag = True
-            self.skip_flag = False
-            
-            # Get fresh URL for streaming
-            with yt_dlp.YoutubeDL(YDL_OPTIONS) as ydl:
+            # A loop rather than recursion, so a long run of unavailable songs stays flat
+            while True:
+                if not self.queue:
+                    self.is_playing_flag = False
+                    self.current_song = None
+                    self.ended_at = None
+                    if self.on_idle:
+                        self.on_idle()
+                    return
+                
+                # Get next song
+                self.current_song = self.queue.pop_next()
+                self._queue_changed()
+                self.is_playing_flag = True
+                self.skip_flag = False
+                self.stream_from_cache = False
+                
+                # Songs interrupted mid-way pick up where they stopped
+                start = self.current_song.pop('resume_at', 0.0)
+                
+                # Create audio source with proper error handling
                 try:
-                    info = ydl.extract_info(self.current_song['webpage_url'], download=False)
-                    
-                    # Handle playlists
-                    if 'entries' in info:
-                        if info['entries']:
-                            info = info['entries'][0]
-                        else:
-                            await self._play_next()
-                            return
-                    
-                    stream_url = info.get('url')
-                    if not stream_url:
-                        logger.error(f'No stream URL found for: {self.current_song["title"]}')
-                        await self._play_next()
-                        return
-                    
-                    # Create audio source with proper error handling
-                    try:
-                        # Find FFmpeg executable
-                        ffmpeg_executable = find_ffmpeg()
-                        
-                        # For local files, use direct path
-                        if self.current_song.get('is_local', False):
-                            audio_source = discord.FFmpegPCMAudio(
-                                self.current_song['url'],
-                                executable=ffmpeg_executable,
-                                options='-vn'
-                            )
-                        else:
-                            # For streaming URLs, use full options
-                            ffmpeg_opts = dict(FFMPEG_OPTIONS)
-                            ffmpeg_opts['executable'] = ffmpeg_executable
-                            audio_source = discord.FFmpegPCMAudio(
-                                stream_url,
-                                **ffmpeg_opts
-                            )
-                        
-                        # Play audio
-                        self.voice_client.play(
-                            audio_source,
-                            after=lambda e: asyncio.run_coroutine_threadsafe(
-                                self._after_playing(e), 
-                                self.voice_client.loop
-                            )
-                        )
-                        
-                    except Exception as audio_error:
-                        logger.error(f'Error creating audio source: {audio_error}')
-                        await self._play_next()
-                        return
+                    # Use the source warmed up while the previous song played, if any
+                    warm = self._take_warm_source(self.current_song, start)
+                    if warm is not None:
+                        audio_source, stream_url = warm
+                    else:
+                        # Get fresh URL for streaming (local files use their path)
+                        stream_url, self.stream_from_cache = await self._take_prefetched(self.current_song)
+                        if not stream_url:
+                            continue
+                        audio_source = self._create_source(self.current_song, stream_url, start)
                     
-                    logger.info(f'Started playing: {self.current_song["title"]}')
+                    # Play audio
+                    self.started_at = time.monotonic()
+                    self.position_source = audio_source
+                    self.voice_client.play(audio_source, after=self._on_track_end)
+                    # Resumes continue a play that was already counted
+                    if start == 0:
+                        self._count_play(self.current_song, stream_url)
+                    break
                     
-                except yt_dlp.utils.DownloadError as e:
-                    logger.error(f'Error getting stream URL: {e}')
-                    await self._play_next()
-                    return
+                except Exception as audio_error:
+                    logger.error(f'Error creating audio source: {audio_error}')
+            
+            self._record_gap()
+            logger.info(f'Started playing: {self.current_song["title"]}')
+            self._schedule_prefetch()
                     
         except Exception as e:
             logger.error(f'Error in _play_next: {e}')
             self.is_playing_flag = False
             self.current_song = None
     
+    def _create_source(self, song: Dict[str, Any], stream_url: str, start: float = 0.0) -> PositionTrackingSource:
+        """Spawn the ffmpeg process for a song, optionally starting `start` seconds in"""
+        # Find FFmpeg executable
+        ffmpeg_executable = find_ffmpeg()
+        # Input seeking: ffmpeg jumps straight to the offset (ranged request for streams)
+        seek = f'-ss {start:.2f}' if start > 0 else ''
+        # Processes are capped and monitored per guild
+        supervision = {'owner': self.voice_client.guild.id, 'supervisor': self.ffmpeg_supervisor}
+        pcm = dict(executable=ffmpeg_executable, **supervision)
+        
+        # Cached encodes already have DEFAULT_VOLUME and the track's loudness
+        # gain applied. At that volume they are passed through as Opus,
+        # skipping both decoding and encoding; otherwise they are decoded and
+        # scaled relative to it.
+        cached = self.opus_cache.lookup(self.opus_cache.key_for(song))
+        if cached:
+            if self.gain.volume == DEFAULT_VOLUME:
+                audio_source = SupervisedOpusAudio(cached, codec='copy', executable=ffmpeg_executable,
+                                                   before_options=seek, **supervision)
+                return PositionTrackingSource(audio_source, start)
+            audio_source = self._pcm_source(cached, 1 / DEFAULT_VOLUME, before_options=seek, options='-vn', **pcm)
+            return PositionTrackingSource(audio_source, start)
+        
+        # Unanalysed tracks play at their own level (see _count_play)
+        track_gain = gain_for_loudness(song.get('loudness'))
+        
+        # For local files, use direct path
+        if song.get('is_local', False):
+            audio_source = self._pcm_source(stream_url, track_gain, before_options=seek, options='-vn', **pcm)
+        else:
+            # For streaming URLs, use full options
+            audio_source = self._pcm_source(
+                stream_url,
+                track_gain,
+                before_options=f"{FFMPEG_OPTIONS['before_options']} {seek}".strip(),
+                options=FFMPEG_OPTIONS['options'],
+                **pcm
+            )
+        
+        return PositionTrackingSource(audio_source, start)
+    
+    def _count_play(self, song: Dict[str, Any], stream_url: str):
+        """Count a play that started from the beginning toward the Opus cache and loudness analysis.
+
+        Called once the song's source is actually playing, so warm-ups that
+        get thrown away don't count. Local files are measured in the
+        background and encoded for the cache once their loudness is known;
+        YouTube tracks are measured from the download the cache encodes from
+        once they are hot. Cached encodes are always normalized.
+        """
+        if self.opus_cache.lookup(self.opus_cache.key_for(song)):
+            return
+        normalized = song.get('loudness') is not None or not LOUDNESS_NORMALIZATION
+        cache_filter = f'-filter:a volume={DEFAULT_VOLUME * gain_for_loudness(song.get("loudness")):.4f}'
+        
+        if song.get('is_local', False):
+            self.loudness.schedule(song, stream_url)
+            if normalized:
+                self.opus_cache.record_play(song, stream_url, options=f'-vn {cache_filter}')
+        elif normalized:
+            self.opus_cache.record_play(song, stream_url, before_options=FFMPEG_OPTIONS['before_options'],
+                                        options=f"{FFMPEG_OPTIONS['options']} {cache_filter}")
+        else:
+            self.opus_cache.record_play(song, stream_url, before_options=FFMPEG_OPTIONS['before_options'],
+                                        options=FFMPEG_OPTIONS['options'],
+                                        prepare=lambda path: self._measured_cache_filter(song, path))
+    
+    async def _measured_cache_filter(self, song: Dict[str, Any], path: str) -> Optional[str]:
+        """Measure the local copy of a song being cached; get its gain filter, or None to skip caching"""
+        if await self.loudness.analyse_file(song, path) is None:
+            return None
+        return f'-filter:a volume={DEFAULT_VOLUME * gain_for_loudness(song["loudness"]):.4f}'
+    
+    def _pcm_source(self, source: str, track_gain: float, *, executable: str, before_options: str,
+                    options: str, owner: Any, supervisor: FFmpegSupervisor) -> discord.AudioSource:
+        """Decode a source and scale it by the guild volume, in an audio worker if configured"""
+        if self.audio_workers is not None:
+            remote = self.audio_workers.open_stream({
+                'executable': executable, 'input': source, 'before_options': before_options,
+                'options': options, 'track_gain': track_gain, 'owner': owner,
+            }, self.gain)
+            # None while every worker is down and being restarted
+            if remote is not None:
+                return remote
+        
+        # Volume is applied per frame in-process so it can change mid-song
+        audio_source = SupervisedPCMAudio(source, executable=executable, before_options=before_options,
+                                          options=options, owner=owner, supervisor=supervisor)
+        return GainTransformer(audio_source, self.gain, track_gain=track_gain)
+    
+    async def _lookup_stream(self, song: Dict[str, Any]) -> Tuple[Optional[str], bool]:
+        """Get a playable URL for a song and whether it came from the stream cache"""
+        await self.loudness.load(song)
+        if song.get('is_local', False):
+            return song['url'], False
+        
+        # Tracks in the Opus cache play from disk and need no stream URL
+        cached = self.opus_cache.lookup(self.opus_cache.key_for(song))
+        if cached:
+            return cached, False
+        
+        video_id = song.get('id')
+        if video_id:
+            cached = self.stream_cache.get(video_id, min_remaining=song.get('duration') or 0)
+            if cached:
+                return cached['url'], True
+        
+        try:
+            info = await self.extractor.extract(song['webpage_url'])
+        except (ExtractionTimeout, ExtractionError) as e:
+            logger.error(f'Error getting stream URL: {e}')
+            return None, False
+        
+        # Handle playlists
+        if 'entries' in info:
+            if not info['entries']:
+                return None, False
+            info = info['entries'][0]
+        
+        self.stream_cache.put(info.get('id') or video_id, info)
+        await self.metadata_store.save(info)
+        stream_url = info.get('url')
+        if not stream_url:
+            logger.error(f'No stream URL found for: {song["title"]}')
+        return stream_url, False
+    
+    def _schedule_prefetch(self):
+        """Start resolving the next queued song while the current one plays"""
+        self._cancel_prefetch()
+        if not self.queue or not self.is_playing_flag:
+            return
+        
+        song = self.queue[0]
+        lookup = asyncio.ensure_future(self._lookup_stream(song))
+        self.prefetched = (song, lookup)
+        if PREFETCH_WARM_FFMPEG:
+            self.prefetch_task = asyncio.create_task(self._warm_up(song, lookup))
+    
+    def _cancel_prefetch(self):
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+        self.prefetch_task = None
+        if self.prefetched:
+            self.prefetched[1].cancel()
+            self.prefetched = None
+        self._discard_warm_source()
+    
+    async def _warm_up(self, song: Dict[str, Any], lookup: 'asyncio.Future'):
+        """Spawn a song's ffmpeg process shortly before the current song ends"""
+        try:
+            stream_url, from_cache = await asyncio.shield(lookup)
+            if not stream_url or not self.current_song:
+                return
+            
+            # Opening the input early means it is already buffered at handover
+            remaining = (self.current_song.get('duration') or 0) - self.position
+            await asyncio.sleep(max(0.0, remaining - PREFETCH_WARM_LEAD))
+            
+            if self.queue and self.queue[0] is song:
+                # A restored or interrupted song warms up at the position it resumes from
+                start = song.get('resume_at', 0.0)
+                self.warm_source = (song, self._create_source(song, stream_url, start), stream_url, from_cache, start)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f'Prefetch failed for {song.get("title")}: {e}')
+    
+    async def _take_prefetched(self, song: Dict[str, Any]) -> Tuple[Optional[str], bool]:
+        """Get a song's stream URL, reusing the prefetch lookup if it was for this song"""
+        if self.prefetched and self.prefetched[0] is song:
+            lookup = self.prefetched[1]
+            self.prefetched = None
+            try:
+                return await lookup
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'Prefetched lookup failed for {song.get("title")}: {e}')
+        return await self._lookup_stream(song)
+    
+    def _take_warm_source(self, song: Dict[str, Any], start: float) -> Optional[Tuple[PositionTrackingSource, str]]:
+        """Get the pre-spawned source (and its stream URL) for a song starting at `start`, if prefetch made one"""
+        if self.warm_source and self.warm_source[0] is song and self.warm_source[4] == start:
+            _, source, stream_url, self.stream_from_cache, _ = self.warm_source
+            self.warm_source = None
+            return source, stream_url
+        self._discard_warm_source()
+        return None
+    
+    def _discard_warm_source(self):
+        if self.warm_source:
+            self.warm_source[1].cleanup()
+            self.warm_source = None
+    
+    def _on_track_end(self, error: Optional[Exception]):
+        """Player-thread callback; hands control back to the event loop"""
+        self.ended_at = time.monotonic()
+        asyncio.run_coroutine_threadsafe(self._after_playing(error), self.voice_client.loop)
+    
+    def _record_gap(self):
+        """Record the silence between the previous song ending and this one starting"""
+        if self.ended_at is None:
+            return
+        gap = self.started_at - self.ended_at
+        self.ended_at = None
+        INTERTRACK_GAP.observe(gap)
+        logger.debug(f'Inter-track gap: {gap * 1000:.0f}ms')
+    
     async def _after_playing(self, error):
         """Called after a song finishes playing"""
         if error:
             logger.error(f'Player error: {error}')
         
-        # Only play next if not manually skipped
-        if not self.skip_flag:
+        song = self.current_song
+        position = self.position
+        self.position_source = None
+        
+        # A cached stream URL that ends almost immediately most likely failed to
+        # open in ffmpeg; drop it and retry the same song with a fresh extraction
+        if song and self.stream_from_cache and not self.skip_flag:
+            played_for = time.monotonic() - self.started_at
+            if played_for < STREAM_FAILURE_WINDOW < (song.get('duration') or 0):
+                logger.warning(f'Cached stream failed for {song["title"]}, re-extracting')
+                self.stream_cache.invalidate(song.get('id'))
+                self.stream_from_cache = False
+                if position > 0:
+                    song['resume_at'] = position
+                self.queue.push_front(song)
+                song = None
+        
+        # A song that stopped well before its end, without a skip or stop, lost
+        # its stream or its voice connection; continue it from the same frame
+        if song and self.is_playing_flag and not self.skip_flag and self._was_interrupted(song, position):
+            song['resume_at'] = position
+            song['resume_attempts'] = song.get('resume_attempts', 0) + 1
+            self.queue.push_front(song)
+            if not self.voice_client.is_connected():
+                logger.warning(f'Voice connection lost during {song["title"]}, holding it at {position:.0f}s')
+                self.is_playing_flag = False
+                self.current_song = None
+                self.resume_task = asyncio.create_task(self._resume_after_reconnect())
+                return
+            logger.warning(f'Stream for {song["title"]} ended early, resuming at {position:.0f}s')
+        
+        # Only play next if playback wasn't stopped
+        if self.is_playing_flag:
             await self._play_next()
+        else:
+            self.ended_at = None
+    
+    @staticmethod
+    def _was_interrupted(song: Dict[str, Any], position: float) -> bool:
+        """Check whether a song ended too early to have finished on its own"""
+        duration = song.get('duration') or 0
+        return (position > 0 and position < duration - RESUME_END_MARGIN
+                and song.get('resume_attempts', 0) < RESUME_MAX_ATTEMPTS)
+    
+    async def _resume_after_reconnect(self):
+        """Continue the held song once the voice client is connected again"""
+        try:
+            deadline = time.monotonic() + RESUME_RECONNECT_TIMEOUT
+            while not self.voice_client.is_connected():
+                if time.monotonic() > deadline:
+                    logger.warning('Voice connection did not come back; keeping the queue paused')
+                    return
+                await asyncio.sleep(1)
+            self.is_playing_flag = True
+            await self._play_next()
+        finally:
+            self.resume_task = None
+    
+    def _queue_changed(self):
+        if self.on_queue_change:
+            self.on_queue_change()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Get the current song (with its position) and the queue, for persisting"""
+        songs = []
+        if self.current_song:
+            current = dict(self.current_song)
+            current['resume_at'] = self.position
+            songs.append(current)
+        songs.extend(self.queue)
+        # Attempt counts belong to this run only
+        return {'songs': [{k: v for k, v in song.items() if k != 'resume_attempts'} for song in songs]}
+    
+    async def restore(self, snapshot: Dict[str, Any]) -> int:
+        """Queue the songs of a snapshot and start playing them; returns how many were queued"""
+        added = self.queue.add_many(snapshot.get('songs', []))
+        if added:
+            self._queue_changed()
+            if self._idle():
+                await self._play_next()
+        return added
+    
+    def _idle(self) -> bool:
+        """Check whether new songs should start playback right away"""
+        return not self.is_active()
+    
+    def is_active(self) -> bool:
+        """Check whether a song is playing or held for a voice reconnect"""
+        # A held song resumes by itself
+        return self.is_playing_flag or self.resume_task is not None
+    
+    @property
+    def position(self) -> float:
+        """Seconds into the current song"""
+        return self.position_source.position if self.position_source else 0.0
+    
+    async def seek(self, seconds: float) -> bool:
+        """Jump to a position in the current song.
+
+        Restarts ffmpeg at the offset against the cached stream URL (or the
+        local/cached file) and swaps it in without ending the song.
+        """
+        song = self.current_song
+        if not song or self.position_source is None:
+            return False
+        duration = song.get('duration') or 0
+        if seconds < 0 or (duration and seconds >= duration):
+            raise ValueError('Position is outside the song')
+        
+        stream_url, from_cache = await self._lookup_stream(song)
+        if not stream_url or song is not self.current_song or self.position_source is None:
+            return False
+        
+        new_source = self._create_source(song, stream_url, seconds)
+        old_source = self.voice_client.source
+        try:
+            # Replacing the source keeps the player running, so no after-callback fires
+            self.voice_client.source = new_source
+        except (ValueError, discord.ClientException):
+            new_source.cleanup()
+            return False
+        self.position_source = new_source
+        self.stream_from_cache = from_cache
+        self.started_at = time.monotonic()
+        if old_source is not None:
+            old_source.cleanup()
+        self._queue_changed()
+        
+        # Re-time the warm-up of the next song from the new position
+        if PREFETCH_WARM_FFMPEG and self.prefetched:
+            if self.prefetch_task and not self.prefetch_task.done():
+                self.prefetch_task.cancel()
+            self._discard_warm_source()
+            self.prefetch_task = asyncio.create_task(self._warm_up(*self.prefetched))
+        return True
+    
+    def set_volume(self, volume: float) -> bool:
+        """Set the playback volume (1.0 = unchanged).
+
+        Returns False if the current song is an Opus passthrough and the new
+        volume only applies from the next song.
+        """
+        self.gain.volume = max(0.0, min(MAX_VOLUME, volume))
+        source = self.voice_client.source
+        # Worker streams are Opus too, but scaled before encoding
+        return (source is None or not source.is_opus()
+                or isinstance(getattr(source, 'original', None), RemoteAudioSource))
     
     def skip(self):
         """Skip the current song"""
@@ -251,10 +657,66 @@ class MusicPlayer:
             self.skip_flag = True
             self.voice_client.stop()
     
+    async def stop(self):
+        """Stop playback and clear the queue"""
+        self.is_playing_flag = False
+        if self.resume_task:
+            self.resume_task.cancel()
+            self.resume_task = None
+        self._cancel_prefetch()
+        self.queue.clear()
+        self._queue_changed()
+        if self.voice_client.is_playing():
+            self.voice_client.stop()
+        self.current_song = None
+        if self.on_idle:
+            self.on_idle()
+    
+    def _head_changed(self, previous_head: Optional[Dict[str, Any]]):
+        """Re-target prefetch if a queue edit changed which song plays next"""
+        if self.queue.peek() is not previous_head:
+            self._schedule_prefetch()
+    
+    def remove(self, position: int) -> Dict[str, Any]:
+        """Remove the song at a 1-based queue position"""
+        head = self.queue.peek()
+        song = self.queue.remove(position - 1)
+        self._queue_changed()
+        self._head_changed(head)
+        return song
+    
+    def move(self, source: int, destination: int) -> Dict[str, Any]:
+        """Move a song between 1-based queue positions"""
+        head = self.queue.peek()
+        song = self.queue.move(source - 1, destination - 1)
+        self._queue_changed()
+        self._head_changed(head)
+        return song
+    
+    def shuffle(self):
+        """Shuffle the upcoming songs"""
+        head = self.queue.peek()
+        self.queue.shuffle()
+        self._queue_changed()
+        self._head_changed(head)
+    
     def is_playing(self) -> bool:
         """Check if music is currently playing"""
         return self.voice_client.is_playing()
     
+    def get_queue(self, page: int = 1, per_page: int = QUEUE_PAGE_SIZE) -> Dict[str, Any]:
+        """Get one page of the queue (pages start at 1) plus the current song"""
+        pages = self.queue.page_count(per_page)
+        page = max(1, min(page, pages))
+        start = (page - 1) * per_page
+        return {
+            'current': self.current_song,
+            'songs': [(start + i + 1, song) for i, song in enumerate(self.queue.page(page - 1, per_page))],
+            'page': page,
+            'pages': pages,
+            'total': len(self.queue)
+        }
+    
     def get_queue_info(self) -> Optional[Dict[str, Any]]:
         """Get information about the current queue"""
         if not self.current_song and not self.queue:
@@ -262,26 +724,28 @@ class MusicPlayer:
         
         return {
             'current': self.current_song['title'] if self.current_song else None,
-            'upcoming': [song['title'] for song in self.queue]
+            'position': self.position,
+            'upcoming': [song['title'] for song in self.queue.page(0, QUEUE_PAGE_SIZE)],
+            'total': len(self.queue)
         }
     
     def get_available_songs(self) -> List[str]:
         """Get list of available local songs"""
         return self.music_library.get_music_list()
     
-    def refresh_music_library(self):
+    def search_songs(self, query: str, limit: int = 25) -> List[str]:
+        """Search local songs by name or tags"""
+        return self.music_library.search(query, limit)
+    
+    async def refresh_music_library(self):
         """Refresh the music library"""
-        self.music_library.refresh_library()
+        await library_service.refresh()
     
     async def cleanup(self):
         """Cleanup the music player"""
         try:
-            if self.voice_client.is_playing():
-                self.voice_client.stop()
-            
-            self.queue.clear()
-            self.current_song = None
-            self.is_playing_flag = False
+            self.on_idle = None
+            await self.stop()
             self.skip_flag = False
             
             logger.info('Music player cleaned up')
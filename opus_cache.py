@@ -0,0 +1,280 @@
+"""
+On-disk cache of pre-encoded Ogg/Opus files for repeat plays
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import shlex
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import (
+    OPUS_CACHE_DIR, OPUS_CACHE_MAX_BYTES, OPUS_CACHE_HOT_PLAYS, OPUS_CACHE_BITRATE,
+    OPUS_ENCODE_CONCURRENCY
+)
+from ffmpeg_locator import get_ffmpeg_info
+from metadata_store import track_key
+
+logger = logging.getLogger(__name__)
+
+# Play counts kept for tracks that aren't hot yet, oldest forgotten first
+MAX_TRACKED_PLAYS = 10000
+
+# Bumped when the processing baked into encodes changes, so stale encodes
+# stop matching and age out of the LRU (2: loudness normalized)
+ENCODE_VERSION = 2
+
+
+class OpusCache:
+    """Size-bounded LRU cache of Ogg/Opus encodes.
+
+    Cached files are played with ``discord.FFmpegOpusAudio(codec='copy')``, so
+    repeat plays skip both decoding in ffmpeg and Opus encoding in discord.py.
+    Local library tracks are encoded after their first play, YouTube tracks
+    once they have been played OPUS_CACHE_HOT_PLAYS times.
+
+    An encode can be given a `prepare` step: the source is then first copied
+    to a local file without re-encoding, `prepare` inspects that copy (e.g.
+    measures its loudness) and returns the output options to encode it with,
+    so the source is only fetched once.
+    """
+
+    def __init__(self, directory: str = OPUS_CACHE_DIR, max_bytes: int = OPUS_CACHE_MAX_BYTES,
+                 hot_plays: int = OPUS_CACHE_HOT_PLAYS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hot_plays = hot_plays
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()  # file name -> size, oldest first
+        self._total_bytes = 0
+        self._play_counts: Dict[str, int] = {}
+        self._encoding: Dict[str, asyncio.Task] = {}
+        self._encode_slots: Optional[asyncio.Semaphore] = None
+        self._load()
+
+    def _load(self):
+        """Index existing cache files, least recently used first"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.is_file()]
+        except FileNotFoundError:
+            return
+        files = []
+        for entry in entries:
+            if entry.name.endswith('.ogg'):
+                files.append(entry)
+            elif entry.name.endswith(('.ogg.part', '.ogg.src.mka')):
+                # Left by an encode that was killed; nothing else would ever remove it
+                _remove(entry.path)
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            size = entry.stat().st_size
+            self._entries[entry.name] = size
+            self._total_bytes += size
+
+    @staticmethod
+    def key_for(song: Dict[str, Any]) -> Optional[str]:
+        """Get the cache key for a song"""
+        return track_key(song)
+
+    @staticmethod
+    def _file_name(key: str) -> str:
+        return hashlib.sha1(f'{key}:v{ENCODE_VERSION}'.encode('utf-8')).hexdigest() + '.ogg'
+
+    def lookup(self, key: Optional[str]) -> Optional[str]:
+        """Get the cached encode for a key and mark it recently used"""
+        if key is None:
+            return None
+        name = self._file_name(key)
+        if name not in self._entries:
+            return None
+
+        path = os.path.join(self.directory, name)
+        try:
+            os.utime(path)
+        except OSError:
+            # Removed behind our back
+            self._total_bytes -= self._entries.pop(name)
+            return None
+        self._entries.move_to_end(name)
+        return path
+
+    def record_play(self, song: Dict[str, Any], source: str, before_options: str = '', options: str = '',
+                    prepare: Optional[Callable[[str], Awaitable[Optional[str]]]] = None):
+        """Count a play and start a background encode once the song is hot"""
+        key = self.key_for(song)
+        if key is None or key in self._encoding or self.lookup(key):
+            return
+
+        plays = self._play_counts.pop(key, 0) + 1
+        self._play_counts[key] = plays
+        if len(self._play_counts) > MAX_TRACKED_PLAYS:
+            del self._play_counts[next(iter(self._play_counts))]
+        threshold = 1 if song.get('is_local') else self.hot_plays
+        if plays < threshold:
+            return
+
+        self._play_counts.pop(key, None)
+        task = asyncio.create_task(self._encode(key, source, before_options, options, prepare))
+        self._encoding[key] = task
+        task.add_done_callback(lambda _: self._encoding.pop(key, None))
+
+    @staticmethod
+    async def _run_ffmpeg(args: List[str], output: str, what: str) -> bool:
+        """Run one ffmpeg job at low priority; a failed job's output file is removed"""
+        process = None
+        try:
+            # Low priority so live playback always wins the CPU
+            process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+                preexec_fn=(lambda: os.nice(10)) if hasattr(os, 'nice') else None
+            )
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            if process and process.returncode is None:
+                process.kill()
+            _remove(output)
+            raise
+        except OSError as e:
+            logger.warning(f'Could not start {what}: {e}')
+            return False
+
+        if process.returncode != 0:
+            logger.warning(f'{what} failed: {stderr.decode(errors="replace").strip()[:200]}')
+            _remove(output)
+            return False
+        return True
+
+    async def _encode(self, key: str, source: str, before_options: str, options: str,
+                      prepare: Optional[Callable[[str], Awaitable[Optional[str]]]] = None):
+        """Encode a source to Ogg/Opus with ffmpeg and add it to the cache"""
+        ffmpeg = get_ffmpeg_info()
+        if not ffmpeg.get('libopus'):
+            return
+
+        if self._encode_slots is None:
+            self._encode_slots = asyncio.Semaphore(OPUS_ENCODE_CONCURRENCY)
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = self._file_name(key)
+        final_path = os.path.join(self.directory, name)
+        temp_path = final_path + '.part'
+        copy_path = final_path + '.src.mka'
+
+        async with self._encode_slots:
+            try:
+                if prepare is not None:
+                    # Fetch once, without decoding, and let prepare inspect the local copy
+                    copied = await self._run_ffmpeg([
+                        ffmpeg['path'], '-nostdin', '-loglevel', 'error', '-y',
+                        *shlex.split(before_options), '-i', source, '-vn', '-c:a', 'copy', '-f', 'matroska', copy_path
+                    ], copy_path, 'Audio download for the Opus cache')
+                    if not copied:
+                        return
+                    extra_options = await prepare(copy_path)
+                    if extra_options is None:
+                        return
+                    source, before_options = copy_path, ''
+                    options = f'{options} {extra_options}'
+
+                encoded = await self._run_ffmpeg([
+                    ffmpeg['path'], '-nostdin', '-loglevel', 'error', '-y',
+                    *shlex.split(before_options), '-i', source, *shlex.split(options),
+                    '-vn', '-c:a', 'libopus', '-b:a', OPUS_CACHE_BITRATE, '-ar', '48000', '-ac', '2',
+                    '-f', 'ogg', temp_path
+                ], temp_path, 'Opus encode')
+            finally:
+                if prepare is not None:
+                    _remove(copy_path)
+        if not encoded:
+            return
+
+        os.replace(temp_path, final_path)
+        size = os.path.getsize(final_path)
+        self._entries[name] = size
+        self._entries.move_to_end(name)
+        self._total_bytes += size
+        logger.debug(f'Cached Opus encode {name} ({size // 1024} KiB)')
+        self._evict()
+
+    def _evict(self):
+        """Delete least recently used encodes until the cache fits its size cap"""
+        while self._total_bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        """Get the number of cached encodes and their total size"""
+        return {'entries': len(self._entries), 'bytes': self._total_bytes, 'encoding': len(self._encoding)}
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Shared by every guild's MusicPlayer
+opus_cache = OpusCache()
+
+
+if __name__ == "__main__":
+    # Benchmark: CPU per concurrent stream, live PCM + Opus encode vs cached passthrough
+    #   python opus_cache.py <audio file> [streams] [seconds]
+    import resource
+    import sys
+    import tempfile
+    import threading
+    import time
+
+    import discord
+
+    source_file = sys.argv[1]
+    streams = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 30
+    frames = int(seconds * 50)  # 20ms frames
+    ffmpeg_path = get_ffmpeg_info()['path']
+
+    def cpu_seconds() -> float:
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+    def play(make_source, encode: bool):
+        source = make_source()
+        encoder = discord.opus.Encoder() if encode else None
+        for _ in range(frames):
+            data = source.read()
+            if not data:
+                break
+            if encoder:
+                encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        source.cleanup()
+
+    def run(label: str, make_source, encode: bool):
+        before = cpu_seconds()
+        threads = [threading.Thread(target=play, args=(make_source, encode)) for _ in range(streams)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        used = cpu_seconds() - before
+        print(f'{label}: {used:.2f} CPU-s total, {used / streams / seconds * 100:.1f}% of a core per stream')
+
+    if not discord.opus.is_loaded():
+        discord.opus._load_default()
+
+    with tempfile.TemporaryDirectory() as directory:
+        encoded = os.path.join(directory, 'cached.ogg')
+        started = time.perf_counter()
+        os.system(f'{shlex.quote(ffmpeg_path)} -loglevel error -y -i {shlex.quote(source_file)} -vn '
+                  f'-c:a libopus -b:a {OPUS_CACHE_BITRATE} -ar 48000 -ac 2 -f ogg {shlex.quote(encoded)}')
+        print(f'One-off encode took {time.perf_counter() - started:.2f}s')
+
+        run('Without cache (PCM + Opus encode)',
+            lambda: discord.FFmpegPCMAudio(source_file, executable=ffmpeg_path, options='-vn'), True)
+        run('With cache (Opus passthrough)',
+            lambda: discord.FFmpegOpusAudio(encoded, codec='copy', executable=ffmpeg_path), False)
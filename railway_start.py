@@ -8,8 +8,6 @@ import sys
 import urllib.request
 import tarfile
 import shutil
-from keep_alive import keep_alive
-keep_alive()
 
 def download_ffmpeg():
     """Download FFmpeg for Railway deployment"""
@@ -66,7 +64,8 @@ def main():
     if not download_ffmpeg():
         print("Failed to install FFmpeg, but continuing anyway...")
     
-    # Start the Discord bot
+    # Start the Discord bot; it serves the keep-alive and metrics endpoints itself,
+    # since a server started here would not survive the exec
     print("Starting Discord bot...")
     os.execv(sys.executable, [sys.executable, "main.py"])
 
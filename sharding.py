@@ -0,0 +1,114 @@
+"""
+Shard configuration and a launcher that runs the bot as several shard processes
+
+    python sharding.py --shards 16 --processes 4
+
+starts four copies of main.py, each connecting shards 0-3, 4-7, ... of 16.
+Every process only receives events for the guilds on its own shards, so each
+one holds music players and guild state for its own guilds only, and voice
+encoding is spread over one CPU core per process.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from config import SHARD_COUNT, SHARD_IDS
+
+
+def parse_shard_ids(text: Optional[str]) -> Optional[List[int]]:
+    """Parse a shard list such as "0-3,8,10-11"; returns None for empty input"""
+    if not text or not text.strip():
+        return None
+    shard_ids = []
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-', 1)
+            shard_ids.extend(range(int(first), int(last) + 1))
+        else:
+            shard_ids.append(int(part))
+    return sorted(set(shard_ids))
+
+
+def format_shard_ids(shard_ids: List[int]) -> str:
+    """Format a contiguous shard range as "first-last" """
+    return f'{shard_ids[0]}-{shard_ids[-1]}' if len(shard_ids) > 1 else str(shard_ids[0])
+
+
+def shard_for_guild(guild_id: int, shard_count: int) -> int:
+    """Get the shard Discord routes a guild's events to"""
+    return (guild_id >> 22) % shard_count
+
+
+def split_shards(shard_count: int, processes: int) -> List[List[int]]:
+    """Split shards 0..shard_count-1 into contiguous, near-equal ranges"""
+    processes = max(1, min(processes, shard_count))
+    base, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for index in range(processes):
+        size = base + (1 if index < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+def shard_options() -> Dict[str, Any]:
+    """Get the AutoShardedBot shard arguments from SHARD_COUNT and SHARD_IDS"""
+    shard_ids = parse_shard_ids(SHARD_IDS)
+    if shard_ids is not None:
+        if SHARD_COUNT is None:
+            raise ValueError('SHARD_IDS needs SHARD_COUNT to be set')
+        if shard_ids[-1] >= SHARD_COUNT:
+            raise ValueError(f'SHARD_IDS {SHARD_IDS} is out of range for {SHARD_COUNT} shards')
+    # Both None lets discord.py ask the gateway for the recommended count
+    return {'shard_count': SHARD_COUNT, 'shard_ids': shard_ids}
+
+
+def launch(shard_count: int, processes: int, restart_delay: float = 5.0):
+    """Run one main.py per shard range and restart any that exit"""
+    ranges = split_shards(shard_count, processes)
+    children: Dict[int, subprocess.Popen] = {}
+    stopping = False
+
+    def start(index: int):
+        env = dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_IDS=format_shard_ids(ranges[index]),
+                   SHARD_PROCESS_INDEX=str(index))
+        children[index] = subprocess.Popen([sys.executable, 'main.py'], env=env)
+        print(f'Started shards {format_shard_ids(ranges[index])} of {shard_count} (pid {children[index].pid})')
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for child in children.values():
+            child.send_signal(signal.SIGINT)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(len(ranges)):
+        start(index)
+
+    while children:
+        time.sleep(1)
+        for index, child in list(children.items()):
+            if child.poll() is None:
+                continue
+            if stopping:
+                del children[index]
+                continue
+            print(f'Shards {format_shard_ids(ranges[index])} exited with {child.returncode}; restarting')
+            time.sleep(restart_delay)
+            start(index)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the bot as several shard processes')
+    parser.add_argument('--shards', type=int, required=True, help='total number of shards')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='number of processes')
+    args = parser.parse_args()
+    launch(args.shards, args.processes)
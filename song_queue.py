@@ -0,0 +1,115 @@
+"""
+Bounded song queue for a guild's music player
+"""
+import random
+from collections import deque
+from itertools import islice
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional
+
+from config import MAX_QUEUE_SIZE
+
+
+class QueueFullError(Exception):
+    """Raised when adding a song would exceed the queue's size cap"""
+
+
+class SongQueue:
+    """Deque-backed song queue with a size cap and paginated views.
+
+    Adding and taking songs from either end is O(1). Index-based operations
+    (insert, remove, move) shift entries inside the deque in C, which stays
+    fast at thousands of entries. Positions in the public API are 0-based.
+    """
+
+    def __init__(self, max_size: int = MAX_QUEUE_SIZE):
+        self.max_size = max_size
+        self._songs: Deque[Dict[str, Any]] = deque()
+
+    def _check_capacity(self, count: int = 1):
+        if len(self._songs) + count > self.max_size:
+            raise QueueFullError(f'Queue is full (max {self.max_size} songs)')
+
+    def add(self, song: Dict[str, Any]) -> int:
+        """Add a song to the end of the queue and return its position"""
+        self._check_capacity()
+        self._songs.append(song)
+        return len(self._songs) - 1
+
+    def add_many(self, songs: Iterable[Dict[str, Any]]) -> int:
+        """Add songs until the queue is full and return how many were added"""
+        added = 0
+        for song in songs:
+            if len(self._songs) >= self.max_size:
+                break
+            self._songs.append(song)
+            added += 1
+        return added
+
+    def insert(self, position: int, song: Dict[str, Any]):
+        """Insert a song at a position (clamped to the queue bounds)"""
+        self._check_capacity()
+        self._songs.insert(max(0, min(position, len(self._songs))), song)
+
+    def push_front(self, song: Dict[str, Any]):
+        """Put a song back at the head, e.g. to retry it; ignores the size cap"""
+        self._songs.appendleft(song)
+
+    def pop_next(self) -> Optional[Dict[str, Any]]:
+        """Take the song at the head of the queue"""
+        return self._songs.popleft() if self._songs else None
+
+    def peek(self) -> Optional[Dict[str, Any]]:
+        """Get the song at the head of the queue without removing it"""
+        return self._songs[0] if self._songs else None
+
+    def remove(self, position: int) -> Dict[str, Any]:
+        """Remove and return the song at a position"""
+        if not 0 <= position < len(self._songs):
+            raise IndexError('Queue position out of range')
+        song = self._songs[position]
+        del self._songs[position]
+        return song
+
+    def move(self, source: int, destination: int) -> Dict[str, Any]:
+        """Move the song at source to destination and return it"""
+        song = self.remove(source)
+        self._songs.insert(max(0, min(destination, len(self._songs))), song)
+        return song
+
+    def shuffle(self):
+        """Shuffle the queue in place"""
+        # Shuffling a deque directly is O(n^2) because of its indexing cost
+        songs = list(self._songs)
+        random.shuffle(songs)
+        self._songs = deque(songs)
+
+    def clear(self):
+        """Remove all songs"""
+        self._songs.clear()
+
+    def page(self, page: int, per_page: int) -> List[Dict[str, Any]]:
+        """Get one page of songs (pages start at 0) without copying the queue"""
+        start = max(0, page) * per_page
+        if start >= len(self._songs):
+            return []
+        # Walk from whichever end of the deque is closer
+        if start > len(self._songs) // 2:
+            tail = len(self._songs) - start
+            return list(islice(reversed(self._songs), max(0, tail - per_page), tail))[::-1]
+        return list(islice(self._songs, start, start + per_page))
+
+    def page_count(self, per_page: int) -> int:
+        """Get the number of pages needed to show the queue"""
+        return max(1, -(-len(self._songs) // per_page))
+
+    def __len__(self) -> int:
+        return len(self._songs)
+
+    def __bool__(self) -> bool:
+        return bool(self._songs)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._songs)
+
+    def __getitem__(self, position: int) -> Dict[str, Any]:
+        return self._songs[position]
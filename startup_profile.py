@@ -0,0 +1,87 @@
+"""
+Startup timing: how long import, login, setup, gateway connect and command sync take
+
+Import this before anything else in main.py so the import phase covers the
+whole module. Phases are recorded as the bot reaches each milestone, and the
+breakdown is logged once at the first ready and exposed on /metrics.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _process_age() -> Optional[float]:
+    """Seconds since this process started, from /proc where available"""
+    try:
+        with open('/proc/self/stat', 'rb') as f:
+            fields = f.read().rsplit(b')', 1)[1].split()
+        with open('/proc/uptime', 'rb') as f:
+            uptime = float(f.read().split()[0])
+        start_ticks = int(fields[19])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupProfile:
+    """Records consecutive startup phases and reports them once"""
+
+    def __init__(self):
+        # Interpreter startup (and any launcher that exec'd us) before this import
+        self.before_import = _process_age()
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: List[Tuple[str, float]] = []
+        self.ready_at: Optional[float] = None
+        self.reported = False
+
+    def mark(self, phase: str):
+        """End a phase at the current time; it started where the previous one ended"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        """Time a block as its own phase, without moving the phase boundary"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            # Only the first run counts; later ones happen on reconnects
+            if not self.reported:
+                self.phases.append((phase, time.perf_counter() - started))
+
+    def ready(self) -> bool:
+        """Record the first ready; returns False for later readies (reconnects)"""
+        if self.ready_at is not None:
+            return False
+        self.mark('gateway')
+        self.ready_at = time.perf_counter()
+        return True
+
+    def durations(self) -> Dict[str, float]:
+        durations = {}
+        if self.before_import is not None:
+            durations['before_import'] = self.before_import
+        for phase, seconds in self.phases:
+            durations[phase] = durations.get(phase, 0.0) + seconds
+        if self.ready_at is not None:
+            durations['time_to_ready'] = (self.before_import or 0.0) + self.ready_at - self.started
+        return durations
+
+    def report(self):
+        """Log the phase breakdown, once"""
+        if self.reported:
+            return
+        self.reported = True
+        parts = ', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in self.durations().items())
+        logger.info(f'Startup timing: {parts}')
+
+
+# Created when first imported, which should be the first thing main.py does
+startup_profile = StartupProfile()
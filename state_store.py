@@ -0,0 +1,282 @@
+"""
+Persistent per-guild state: exclusion lists, settings and queue snapshots
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from config import STATE_DB_PATH, STATE_FLUSH_INTERVAL, STATE_POSITION_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Sections stored per guild
+EXCLUDED = 'excluded'
+SETTINGS = 'settings'
+QUEUE = 'queue'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS guild_state (
+    guild_id INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (guild_id, section)
+);
+"""
+
+
+class StateBackend(ABC):
+    """Storage for guild state sections; subclass to store them elsewhere"""
+
+    @abstractmethod
+    async def load(self, guild_id: int) -> Dict[str, Any]:
+        """Get every stored section of a guild"""
+
+    @abstractmethod
+    async def save(self, sections: Dict[Tuple[int, str], Any]):
+        """Store a batch of sections, keyed by (guild id, section); None deletes"""
+
+    async def close(self):
+        """Release the backend's resources"""
+
+
+class MemoryStateBackend(StateBackend):
+    """Keeps state in process memory, for tests and throwaway runs"""
+
+    def __init__(self):
+        self.data: Dict[int, Dict[str, Any]] = {}
+
+    async def load(self, guild_id: int) -> Dict[str, Any]:
+        return json.loads(json.dumps(self.data.get(guild_id, {})))
+
+    async def save(self, sections: Dict[Tuple[int, str], Any]):
+        for (guild_id, section), value in sections.items():
+            guild = self.data.setdefault(guild_id, {})
+            if value is None:
+                guild.pop(section, None)
+            else:
+                guild[section] = json.loads(json.dumps(value))
+
+
+class SQLiteStateBackend(StateBackend):
+    """SQLite storage; all database access happens on one dedicated thread"""
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state-store')
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _load(self, guild_id: int) -> Dict[str, Any]:
+        rows = self._connect().execute(
+            'SELECT section, data FROM guild_state WHERE guild_id = ?', (guild_id,)
+        ).fetchall()
+        return {section: json.loads(data) for section, data in rows}
+
+    def _save(self, sections: Dict[Tuple[int, str], Any]):
+        now = time.time()
+        upserts = []
+        deletes = []
+        for (guild_id, section), value in sections.items():
+            if value is None:
+                deletes.append((guild_id, section))
+            else:
+                upserts.append((guild_id, section, json.dumps(value, separators=(',', ':')), now))
+        conn = self._connect()
+        # One transaction per batch
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO guild_state (guild_id, section, data, updated_at) VALUES (?, ?, ?, ?)',
+                upserts
+            )
+            conn.executemany('DELETE FROM guild_state WHERE guild_id = ? AND section = ?', deletes)
+
+    async def load(self, guild_id: int) -> Dict[str, Any]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._load, guild_id)
+
+    async def save(self, sections: Dict[Tuple[int, str], Any]):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._save, sections)
+
+    async def close(self):
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, _close)
+        self._executor.shutdown(wait=True)
+
+
+class GuildState:
+    """One guild's state, loaded on first access"""
+
+    def __init__(self, guild_id: int, data: Dict[str, Any]):
+        self.guild_id = guild_id
+        self.excluded: Set[int] = set(data.get(EXCLUDED, []))
+        self.settings: Dict[str, Any] = dict(data.get(SETTINGS, {}))
+        self.queue: Optional[Dict[str, Any]] = data.get(QUEUE)
+        # Builds a fresh queue snapshot at flush time, set while a player is live
+        self.queue_source: Optional[Callable[[], Optional[Dict[str, Any]]]] = None
+
+    def section(self, name: str) -> Any:
+        """Get a section's value in its stored form"""
+        if name == EXCLUDED:
+            return sorted(self.excluded)
+        if name == SETTINGS:
+            return dict(self.settings)
+        if name == QUEUE:
+            self.refresh_queue()
+            return self.queue
+        raise KeyError(name)
+
+    def refresh_queue(self) -> bool:
+        """Take a fresh queue snapshot from the live player; returns whether it changed"""
+        if self.queue_source is None:
+            return False
+        snapshot = self.queue_source()
+        # An empty queue deletes the stored snapshot
+        snapshot = snapshot if snapshot and snapshot.get('songs') else None
+        changed = snapshot != self.queue
+        self.queue = snapshot
+        return changed
+
+
+class StateStore:
+    """Lazily loaded guild state with write-behind persistence.
+
+    A guild's state is read from the backend the first time it is asked for,
+    so startup cost doesn't grow with the number of guilds. Changes are
+    marked dirty and written in batches at most every STATE_FLUSH_INTERVAL
+    seconds; repeated changes to a section in between cost one write.
+
+    Queue snapshots include the playing song's position, which changes
+    without a queue change; live queues are re-snapshotted every
+    `position_interval` seconds and on close, and written if they differ.
+    """
+
+    def __init__(self, backend: Optional[StateBackend] = None, flush_interval: float = STATE_FLUSH_INTERVAL,
+                 position_interval: float = STATE_POSITION_INTERVAL):
+        self.backend = backend or SQLiteStateBackend()
+        self.flush_interval = flush_interval
+        self.position_interval = position_interval
+        self._guilds: Dict[int, GuildState] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._dirty: Set[Tuple[int, str]] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._position_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start saving the positions of playing songs in the background"""
+        if self._position_task is None:
+            self._position_task = asyncio.create_task(self._save_positions())
+
+    async def _save_positions(self):
+        while True:
+            await asyncio.sleep(self.position_interval)
+            self.refresh_queues()
+
+    def refresh_queues(self):
+        """Mark the queue of every live player dirty if its snapshot (or position) changed"""
+        for guild_id, state in list(self._guilds.items()):
+            try:
+                if state.refresh_queue():
+                    self.mark_dirty(guild_id, QUEUE)
+            except Exception as e:
+                logger.error(f'Snapshotting the queue of guild {guild_id} failed: {e}')
+
+    async def get(self, guild_id: int) -> GuildState:
+        """Get a guild's state, loading it on first access"""
+        state = self._guilds.get(guild_id)
+        if state is not None:
+            return state
+
+        # Concurrent first accesses share one load
+        loading = self._loading.get(guild_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(guild_id))
+            self._loading[guild_id] = loading
+        return await asyncio.shield(loading)
+
+    async def _load(self, guild_id: int) -> GuildState:
+        try:
+            try:
+                data = await self.backend.load(guild_id)
+            except Exception as e:
+                logger.error(f'Loading state for guild {guild_id} failed: {e}')
+                data = {}
+            state = GuildState(guild_id, data)
+            self._guilds[guild_id] = state
+            return state
+        finally:
+            self._loading.pop(guild_id, None)
+
+    def mark_dirty(self, guild_id: int, section: str):
+        """Schedule a section of a loaded guild to be written"""
+        if guild_id not in self._guilds:
+            return
+        self._dirty.add((guild_id, section))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        # Keeps going while changes arrive during a write
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write every dirty section now"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        batch = {}
+        for guild_id, section in dirty:
+            state = self._guilds.get(guild_id)
+            if state is not None:
+                batch[(guild_id, section)] = state.section(section)
+        try:
+            await self.backend.save(batch)
+            logger.debug(f'Saved {len(batch)} guild state sections')
+        except Exception as e:
+            logger.error(f'Saving guild state failed: {e}')
+            # Retry with the next batch
+            self._dirty |= dirty
+
+    async def unload(self, guild_id: int, keep: Optional[Callable[[], bool]] = None):
+        """Write a guild's pending changes and drop it from memory, unless keep() says it came back into use"""
+        if any(key[0] == guild_id for key in self._dirty):
+            await self.flush()
+        if keep is not None and keep():
+            return
+        self._guilds.pop(guild_id, None)
+
+    async def close(self):
+        """Write pending changes, including where each song is playing, and close the backend"""
+        if self._position_task is not None:
+            self._position_task.cancel()
+            self._position_task = None
+        self.refresh_queues()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self.backend.close()
+
+
+# Shared by the whole bot
+state_store = StateStore()
@@ -0,0 +1,96 @@
+"""
+In-memory cache of resolved YouTube stream URLs
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse, parse_qs
+
+from config import STREAM_CACHE_SIZE, STREAM_CACHE_TTL, STREAM_EXPIRY_MARGIN
+
+logger = logging.getLogger(__name__)
+
+
+def stream_expiry(stream_url: str, default_ttl: float = STREAM_CACHE_TTL) -> float:
+    """Get the wall-clock time a stream URL stops working.
+
+    googlevideo URLs carry an ``expire=<unix time>`` query parameter (sometimes
+    as a ``/expire/<unix time>/`` path segment); anything else gets the default TTL.
+    """
+    parsed = urlparse(stream_url)
+    values = parse_qs(parsed.query).get('expire')
+    if not values:
+        segments = parsed.path.split('/')
+        if 'expire' in segments:
+            index = segments.index('expire') + 1
+            values = segments[index:index + 1]
+    try:
+        return float(values[0])
+    except (TypeError, ValueError, IndexError):
+        return time.time() + default_ttl
+
+
+class StreamCache:
+    """LRU cache of resolved stream URLs and metadata keyed by video id"""
+
+    def __init__(self, max_entries: int = STREAM_CACHE_SIZE, margin: float = STREAM_EXPIRY_MARGIN):
+        self.max_entries = max_entries
+        self.margin = margin
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, video_id: str, min_remaining: float = 0) -> Optional[Dict[str, Any]]:
+        """Get a cached entry that stays valid for at least min_remaining seconds"""
+        entry = self._entries.get(video_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry['expires_at'] - self.margin - min_remaining <= time.time():
+            # Too close to expiry to finish playing; drop it
+            del self._entries[video_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(video_id)
+        self.hits += 1
+        return entry
+
+    def put(self, video_id: str, info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Cache the stream URL and metadata from a yt-dlp info dict"""
+        stream_url = info.get('url')
+        if not video_id or not stream_url:
+            return None
+
+        entry = {
+            'url': stream_url,
+            'title': info.get('title', 'Unknown Title'),
+            'webpage_url': info.get('webpage_url'),
+            'duration': info.get('duration') or 0,
+            'uploader': info.get('uploader', 'Unknown'),
+            'expires_at': stream_expiry(stream_url),
+        }
+        self._entries[video_id] = entry
+        self._entries.move_to_end(video_id)
+
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            logger.debug(f'Evicted stream cache entry: {evicted}')
+        return entry
+
+    def invalidate(self, video_id: str):
+        """Forget a stream URL, e.g. after ffmpeg failed to open it"""
+        self._entries.pop(video_id, None)
+
+    def clear(self):
+        """Remove all cached entries"""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Shared by every guild's MusicPlayer
+stream_cache = StreamCache()
@@ -1,17 +1,12 @@
 import logging
 import discord
+import log_pipeline
 from typing import Union
 
 def setup_logging():
     """Setup logging configuration"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler('discord_bot.log', encoding='utf-8')
-        ]
-    )
+    # Console and file writes happen on a background thread, off the event loop
+    log_pipeline.setup_logging()
     
     # Set discord.py logging level to WARNING to reduce noise
     discord_logger = logging.getLogger('discord')
@@ -39,6 +34,16 @@ def format_duration(seconds: int) -> str:
         seconds = seconds % 60
         return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
+def parse_timestamp(text: str) -> int:
+    """Parse SS, MM:SS or HH:MM:SS into seconds; raises ValueError if malformed"""
+    parts = text.strip().split(':')
+    if not 1 <= len(parts) <= 3 or not all(part.isdigit() for part in parts):
+        raise ValueError(f'Invalid timestamp: {text}')
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return seconds
+
 def validate_youtube_url(url: str) -> bool:
     """Validate if the URL is a valid YouTube URL"""
     youtube_domains = [
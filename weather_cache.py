@@ -0,0 +1,196 @@
+"""
+Cached weather lookups: one upstream request per city per TTL
+"""
+import asyncio
+import logging
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from config import (WEATHER_API_KEY, WEATHER_API_URL, WEATHER_CACHE_TTL, WEATHER_STALE_TTL,
+                    WEATHER_NOT_FOUND_TTL, WEATHER_CACHE_SIZE)
+from http_client import http_client
+
+logger = logging.getLogger(__name__)
+
+
+class WeatherUnavailable(Exception):
+    """The weather API could not answer"""
+
+
+def normalize_city(city: str) -> str:
+    """Get the cache key for a city, so "  new york" and "New York" share an entry"""
+    city = re.sub(r'\s+', ' ', city.strip().casefold())
+    return re.sub(r'\s*,\s*', ',', city)
+
+
+async def fetch_weather(city: str) -> Optional[Dict[str, Any]]:
+    """Get the current weather for a city from OpenWeatherMap; None if the city is unknown"""
+    if not WEATHER_API_KEY:
+        raise WeatherUnavailable('Weather API key not set.')
+    status, data = await http_client.get_json(
+        WEATHER_API_URL,
+        params={"q": city, "appid": WEATHER_API_KEY, "units": "metric"}
+    )
+    if status in (400, 404):
+        return None
+    if status != 200 or not data:
+        raise WeatherUnavailable(f'Weather API returned {status}')
+    return data
+
+
+class WeatherCache:
+    """TTL cache in front of a weather fetch function.
+
+    Fresh entries are returned as-is. Entries past their TTL but within the
+    stale window are returned immediately while one background request
+    refreshes them. Concurrent misses for the same city share a single
+    upstream request. Unknown cities are cached for a shorter time, and a
+    failed refresh keeps the stale entry.
+    """
+
+    def __init__(self, fetch: Callable[[str], Awaitable[Optional[Dict[str, Any]]]] = fetch_weather,
+                 ttl: float = WEATHER_CACHE_TTL, stale_ttl: float = WEATHER_STALE_TTL,
+                 not_found_ttl: float = WEATHER_NOT_FOUND_TTL, max_entries: int = WEATHER_CACHE_SIZE):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.not_found_ttl = not_found_ttl
+        self.max_entries = max_entries
+        # key -> (fetched_at, data)
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refreshing: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.upstream_calls = 0
+
+    async def get(self, city: str) -> Optional[Dict[str, Any]]:
+        """Get a city's weather, or None if the city is unknown"""
+        key = normalize_city(city)
+        entry = self._entries.get(key)
+        if entry is not None:
+            fetched_at, data = entry
+            age = time.monotonic() - fetched_at
+            ttl = self.ttl if data is not None else self.not_found_ttl
+            if age < ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            if data is not None and age < ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    task = asyncio.ensure_future(self._refresh(key, city))
+                    self._refreshing.add(task)
+                    task.add_done_callback(self._refreshing.discard)
+                return data
+
+        self.misses += 1
+        return await asyncio.shield(self._load(key, city))
+
+    def _load(self, key: str, city: str) -> asyncio.Future:
+        """Get the shared upstream request for a key, starting it if needed"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(key, city))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return future
+
+    async def _fetch(self, key: str, city: str) -> Optional[Dict[str, Any]]:
+        self.upstream_calls += 1
+        data = await self.fetch(city)
+        self._entries[key] = (time.monotonic(), data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return data
+
+    async def _refresh(self, key: str, city: str):
+        try:
+            await self._load(key, city)
+        except Exception as e:
+            # The stale entry keeps being served until it runs out
+            logger.warning(f'Refreshing weather for {key} failed: {e}')
+
+    def stats(self) -> Dict[str, int]:
+        """Get hit, miss and upstream request counts"""
+        return {'entries': len(self._entries), 'hits': self.hits, 'stale_hits': self.stale_hits,
+                'misses': self.misses, 'upstream_calls': self.upstream_calls}
+
+
+# Shared by the whole bot
+weather_cache = WeatherCache()
+
+
+def _random_case(text: str) -> str:
+    return '  '.join(word.upper() if random.random() < 0.5 else word.lower() for word in text.split())
+
+
+async def _benchmark(requests: int, cities: int):
+    """Count upstream calls for concurrent lookups against a local stand-in API"""
+    from aiohttp import web
+    from http_client import HTTPClient
+
+    calls = {'count': 0}
+
+    async def handler(request):
+        calls['count'] += 1
+        await asyncio.sleep(0.05)  # API round trip
+        city = request.query['q']
+        if city.casefold().startswith('nowhere'):
+            return web.json_response({'message': 'city not found'}, status=404)
+        return web.json_response({'weather': [{'description': 'clear sky'}],
+                                  'main': {'temp': 20.0, 'feels_like': 19.0}, 'name': city})
+
+    app = web.Application()
+    app.router.add_get('/weather', handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/weather'
+    client = HTTPClient()
+
+    async def fetch(city):
+        status, data = await client.get_json(url, params={'q': city})
+        return data if status == 200 else None
+
+    names = [f'City {i}' for i in range(cities - 1)] + ['Nowhere']
+    # Differently spelled requests for the same cities
+    spellings = [_random_case(names[i % len(names)]) for i in range(requests)]
+    try:
+        cache = WeatherCache(fetch, ttl=0.5, stale_ttl=5)
+        start = time.perf_counter()
+        await asyncio.gather(*(cache.get(city) for city in spellings))
+        print(f'cold: {requests} lookups in {time.perf_counter() - start:.3f}s, '
+              f'{calls["count"]} upstream calls for {cities} cities')
+
+        calls['count'] = 0
+        await asyncio.gather(*(cache.get(city) for city in spellings))
+        print(f'warm: {calls["count"]} upstream calls')
+
+        await asyncio.sleep(0.6)
+        calls['count'] = 0
+        start = time.perf_counter()
+        await asyncio.gather(*(cache.get(city) for city in spellings))
+        served = time.perf_counter() - start
+        await asyncio.sleep(0.2)
+        print(f'stale: served in {served * 1000:.1f}ms, {calls["count"]} background refreshes')
+        print(cache.stats())
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Check weather cache coalescing against a local stand-in API')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--cities', type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(_benchmark(args.requests, args.cities))